@@ -1,17 +1,168 @@
 """The Aggregator class contains a collection of other classes. This script defines a parent Aggregator
 that is inherited by various entities and relationships"""
 
+import os
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack, contextmanager
 
-class _Aggregator:
+import Changes
+from JsonIO import json_filename
+
+
+def uid_order(key):
+    """ Sort key giving the stable order of a store's keys. Numeric uids sort by value, so '9' comes before '10',
+        and before any other strings. The parts of a tuple key, such as the (book_uid, member_uid) keys of Loans,
+        sort in turn, so a tuple of the leading parts sorts before every key starting with them
+    :param key: str or tuple of str: A collection key
+    :returns tuple: The sort key"""
+
+    if isinstance(key, tuple):
+        return tuple(uid_order(part) for part in key)
+    if key.isdigit():
+        return 0, int(key), key
+    return 1, 0, key
+
+
+class _LazyCollection(dict):
+    """ Stands in for a store's collection until it is first used, then restores the store from file.
+        The store's collection is replaced by the restored dictionary, so later calls do not pass through here"""
+
+    def __init__(self, store):
+        super().__init__()
+        self._store = store
+
+    def _load(self):
+        """ Restores the store if it has not been already
+        :returns dict: The store's restored collection"""
+        store = self._store
+        if store.collection is self:
+            store.collection = {}
+            store.restore()
+        return store.collection
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def keys(self):
+        return self._load().keys()
+
+    def values(self):
+        return self._load().values()
+
+    def items(self):
+        return self._load().items()
+
+    def pop(self, *args):
+        return self._load().pop(*args)
+
+    def setdefault(self, key, default=None):
+        return self._load().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._load().update(*args, **kwargs)
+
+    def copy(self):
+        return self._load().copy()
+
+
+class _SharedFile:
+    """ Mixin holding the file lock and version stamp of a JSON file saved by several processes on one host.
+        Used by _Aggregator and Observer.Subject in multi process mode, see _Aggregator.set_shared().
+        The class provides _filename, the file name without a suffix
+
+        Class Attributes:
+        :shared: bool: Multi process mode
+        :_stamp: int: Version stamp of the JSON file when it was last read or written by this process"""
+
+    shared = False
+    _stamp = 0
+    _lock_depth = 0
+    _lock_file = None
+
+    @contextmanager
+    def lock(self):
+        """ Holds the store's file lock, in multi process mode. May be nested. Does nothing otherwise """
+
+        if not self.shared:
+            yield
+            return
+        import fcntl  # Imported here as it is only available on Unix and only needed in multi process mode
+
+        if not self._lock_depth:
+            self._lock_file = open(self._filename + '.lock', mode='a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if not self._lock_depth:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _read_stamp(self):
+        """:returns int: The version stamp of the JSON file. 0 if it has none"""
+
+        try:
+            with open(self._filename + '.version', encoding='utf-8') as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_stamp(self):
+        """ Increments the version stamp after a save. Call while holding the lock """
+
+        self._stamp += 1
+        with open(self._filename + '.version', mode='w', encoding='utf-8') as file:
+            file.write(str(self._stamp))
+
+
+class _Aggregator(_SharedFile):
     """ An inherited class to store relationships.
 
         Class Attributes:
         :collection: dict: dictionary of objects where the keys are unique primary_ids associated with the
         respective values/object
-        :_filename: str:  Holds the name of the file for save / restore methods"""
+        :_filename: str:  Holds the name of the file for save / restore methods
+        :_storage: Storage backend used by save / restore in place of JSON files. None for JSON
+        :_dirty: set: Keys added or changed since the last save. See touch(). None until the first save or restore,
+        meaning every key needs writing
+        :shared: bool: Multi process mode. See set_shared() and _SharedFile
+        :version: int: Number of the current collection, counting restores
+        :keep_versions: int: Number of collections replaced by restore() kept for rollback(). Each one kept holds
+        its objects in memory, so none are kept unless set"""
 
     _filename = 'default'
     collection = {}  # dictionary of objects
+    _storage = None
+    _dirty = None
+    version = 0
+    keep_versions = 0
+    _versions = ()  # (version, collection) pairs, oldest first
+    _order = ()  # Sorted key index. See _ordered()
+    _order_source = None  # The collection _order was built for
 
     def __init__(self):
         pass
@@ -36,33 +187,193 @@ class _Aggregator:
 
          :returns dict: A dictionary of dictionaries"""
 
-        return {key: self.collection[key].as_json_dict() for key in self.collection}
+        return dict(self._json_items())
+
+    def _json_items(self):
+        """ Yields each key of self.collection with its object converted by as_json_dict(), one at a time,
+        for JsonIO.save_to_file() to write as it goes"""
+
+        for key in self.collection:
+            yield key, self.collection[key].as_json_dict()
+
+    def reset(self):
+        """ Gives the instance its own empty self.collection in place of the class level dictionary.
+            Used when a store is created for a library branch"""
+
+        self.collection = {}
+
+    def restore_on_demand(self):
+        """ Defers restore() until self.collection is first used.
+            Lets a short lived process that only needs one store avoid restoring all of them at start up"""
+
+        self.collection = _LazyCollection(self)
+
+    def _ensure_loaded(self):
+        """ Completes a deferred restore. For methods that use an index rather than self.collection"""
+
+        if isinstance(self.collection, _LazyCollection):
+            self.collection._load()
 
     def set_filename(self, filename):
         """ Method to set the default _filename name for save/restore methods"""
 
         self._filename = filename
 
+    def set_storage(self, storage):
+        """ Saves and restores self.collection with a storage backend in place of a JSON file.
+            The next save writes the whole collection, later saves write only the keys changed since
+        :param storage: A storage backend, such as Storage.SqliteStorage(). None returns to JSON files"""
+
+        self._storage = storage
+        self._dirty = None
+
+    def touch(self, *keys):
+        """ Records that the objects with keys have been added or changed, or the keys removed,
+            so the next save includes them
+        :param keys: The self.collection keys"""
+
+        if self._dirty is not None:
+            self._dirty.update(keys)
+
     def restore(self):
         """ Restores self.collection{} from a JSON file, as a dict of objects.
             Calls JsonIO to read and return file data from self._filename
             JSON file should be a Dictionary of dictionaries
-            Backs up self.collection before clearing it. Restores the data if there was a problem reading JSON File
+            The restored data is read into a new dictionary which replaces self.collection only once it is complete,
+            so self.collection is unchanged if there is a problem reading the JSON File.
+            The replaced dictionary is kept as a version that rollback() can return to
+            If a storage backend is set the collection is restored from it instead
 
             :raises Exception: If there is a problem with the restore
             """
-        saved_data = self.collection.copy()  # make a backup copy of data
 
+        stamp = None
         try:
-            self.collection = super().restore(self._filename)
+            if self._storage is not None:
+                collection = self._decode_keys(self._storage.restore(self._filename))
+            else:
+                with self.lock():
+                    collection = self._decode_keys(super().restore(self._filename))
+                    stamp = self._read_stamp()
         except Exception:
-            self.collection = saved_data  # On error, restores data
             raise Exception('JsonIO() unable to restore from file')
+        self._restored(collection, stamp)
+
+    def _restored(self, collection, stamp=None):
+        """ Makes a collection read from file, or a storage backend, the current one. The replaced collection is
+            kept for rollback() and nothing is left to save. Overloaded by stores that rebuild indexes from it
+        :param collection: dict: The collection read, with its keys decoded
+        :param stamp: int: The version stamp of the JSON file read. None if read from a storage backend"""
+
+        self._versions = (self._versions + ((self.version, self.collection),))[-self.keep_versions:] \
+            if self.keep_versions else ()
+        self.collection = collection
+        self.version += 1
+        self._dirty = set()
+        if stamp is not None:
+            self._stamp = stamp
+
+    def versions(self):
+        """:returns list: The version numbers rollback() can return to, oldest first"""
+
+        return [version for version, _ in self._versions]
+
+    def rollback(self, version=None):
+        """ Returns self.collection to a version replaced by an earlier restore(). The current collection and any
+            later versions are discarded. The next save writes the whole collection
+        :param version: int: A number from versions(). Defaults to the most recent
+        :raises LookupError: If the version is not kept"""
+
+        for index, (number, collection) in enumerate(self._versions):
+            if number == version or (version is None and index == len(self._versions) - 1):
+                self._versions = self._versions[:index]
+                self.collection = collection
+                self.version = number
+                self._dirty = None
+                return
+        raise LookupError(f'{type(self).__name__}(): version {version} is not kept')
+
+    def _decode_keys(self, collection):
+        """ Converts the keys of a collection read from a file or storage backend to the form used in memory.
+            Overloaded by stores whose keys are not strings
+        :returns dict: The collection"""
+
+        return collection
+
+    def _encode_keys(self, collection, keys):
+        """ Converts a collection and a set of its keys to the string keys written to a storage backend.
+            Overloaded by stores whose keys are not strings
+        :returns tuple: (collection, keys)"""
+
+        return collection, keys
 
     def save(self):
-        """ Calls JsonIO.save() method which in turns calls self._make_json_dict before writing the file"""
+        """ Calls JsonIO.save() method which in turns calls self._make_json_dict before writing the file
+            If a storage backend is set, only the keys changed since the last save are written to it"""
+
+        if self._storage is not None:
+            # _dirty is None, and the whole collection written, if the store has not been saved or restored since
+            # the backend was set
+            self._storage.save(self._filename, *self._encode_keys(self.collection, self._dirty))
+        elif self.shared:
+            with self.lock():
+                self.sync()  # Takes in changes saved by other processes, so they are not overwritten
+                super().save_to_file(self._filename)
+                self._write_stamp()
+        else:
+            super().save_to_file(self._filename)
+        self._dirty = set()
+
+    def set_shared(self, shared=True):
+        """ Turns on multi process mode, for several processes on one host using the same JSON files.
+            Saves and restores hold an exclusive advisory lock (fcntl) on '<_filename>.lock' and each save
+            increments the version stamp kept in '<_filename>.version'. A save that finds the stamp changed since
+            this process last read or wrote the file merges first, see sync(). Use transaction() to make an
+            operation's reads and writes atomic. The store is restored now if its file exists.
+            Storage backends are not affected. Observer.Subject.set_shared() does the same for the events file
+        :param shared: bool: False turns multi process mode off"""
 
-        super().save_to_file(self._filename)
+        self.shared = shared
+        if shared and os.path.exists(json_filename(self._filename, self.compression)):
+            self.restore()
+
+    def sync(self):
+        """ In multi process mode, takes in the changes other processes have saved since this one last read or
+            wrote the JSON file. Keys changed here since the last save (see touch()) keep their values, other keys
+            take the saved ones. Objects already in self.collection are updated in place, so references held
+            elsewhere stay current
+        :returns bool: True if there were changes to take in"""
+
+        if not self.shared:
+            return False
+        with self.lock():
+            stamp = self._read_stamp()
+            if stamp == self._stamp:
+                return False
+            self._merge(self._decode_keys(super().restore(self._filename)))
+            self._stamp = stamp
+            return True
+
+    def _merge(self, saved):
+        """ Merges a collection read from file into self.collection. See sync()
+        :param saved: dict: The collection read"""
+
+        collection = self.collection
+        changed = self._dirty if self._dirty is not None else set(collection)
+        for key in [key for key in collection if key not in saved and key not in changed]:
+            del collection[key]
+            self._unindex_key(key)
+        for key, value in saved.items():
+            if key in changed:
+                continue
+            current = collection.get(key)
+            if isinstance(current, list) and isinstance(value, list):
+                current[:] = value
+            elif current is not None and type(current) is type(value) and hasattr(current, '__dict__'):
+                current.__dict__.update(value.__dict__)
+            else:
+                collection[key] = value
+                self._index_key(key)
 
     def add(self, obj):
         """ Adds an object to self.collection by calling the parent Aggregator.add() method
@@ -73,6 +384,9 @@ class _Aggregator:
             raise Exception("Duplicate primary_id for object")
         else:
             self.collection[obj_uid] = obj
+            self._index_key(obj_uid)
+            self.touch(obj_uid)
+            Changes.emit('insert', type(obj).__name__, obj_uid, obj)
 
     def search(self, *uid):
         """ Method to find an object in self.collection
@@ -83,3 +397,114 @@ class _Aggregator:
             return self.collection[obj_uid]
         else:
             raise Exception(f'Invalid key: {obj_uid} does not exist')
+
+    def _ordered(self):
+        """ The sorted key index: a list of (uid_order(key), key) pairs for every key of self.collection.
+            Kept up to date by _index_key() and _unindex_key() as keys are added and removed. Rebuilt when
+            self.collection has been replaced, or no longer has the same number of keys
+        :returns list: The index"""
+
+        self._ensure_loaded()
+        if self._order_source is not self.collection or len(self._order) != len(self.collection):
+            self._order = sorted((uid_order(key), key) for key in self.collection)
+            self._order_source = self.collection
+        return self._order
+
+    def _index_key(self, key):
+        """ Adds a key just added to self.collection to the sorted key index, if the index has been built """
+
+        if self._order_source is self.collection:
+            entry = (uid_order(key), key)
+            position = bisect_left(self._order, entry)
+            if position == len(self._order) or self._order[position] != entry:
+                self._order.insert(position, entry)
+
+    def _unindex_key(self, key):
+        """ Removes a key just removed from self.collection from the sorted key index, if it has been built """
+
+        if self._order_source is self.collection:
+            entry = (uid_order(key), key)
+            position = bisect_left(self._order, entry)
+            if position < len(self._order) and self._order[position] == entry:
+                del self._order[position]
+
+    def keys_in_order(self, start=None, stop=None):
+        """ Lists the keys of self.collection in uid_order(), optionally restricted to a key range.
+            Only the keys are copied, not the objects
+        :param start: The first key of the range, included. Need not be in the collection
+        :param stop: The end of the range, excluded. Need not be in the collection
+        :returns list: The keys, in order"""
+
+        ordered = self._ordered()
+        first = 0 if start is None else bisect_left(ordered, (uid_order(start),))
+        last = len(ordered) if stop is None else bisect_left(ordered, (uid_order(stop),))
+        return [key for _, key in ordered[first:last]]
+
+    def iter_items(self, filter=None, batch_size=None, start=None, stop=None):
+        """ Iterates over self.collection in uid_order() without building a copy of the objects or keys.
+            Walks the collection a page at a time with page(), so keys added or removed during the iteration are
+            handled as they are between pages
+        :param filter: callable: Optional. Passed each object, or list of objects for Loans and Reservations.
+        Only items for which it returns True are included
+        :param batch_size: int: Optional. Yield lists of up to batch_size pairs instead of single pairs
+        :param start: The first key of the range, included. See keys_in_order()
+        :param stop: The end of the range, excluded
+        :returns generator: (key, object) pairs, or lists of them"""
+
+        size = batch_size or 100
+        items, after = self.page(None, size, filter, stop, start)
+        while True:
+            if batch_size is None:
+                yield from items
+            elif items:
+                yield items
+            if after is None:
+                return
+            items, after = self.page(after, size, filter, stop)
+
+    def page(self, after=None, limit=100, filter=None, stop=None, start=None):
+        """ Fetches one page of self.collection in uid_order(). A cursor for reporting tools that fetch a page at
+            a time: pass the key returned with one page as after to fetch the next. The page is found by a binary
+            search of the sorted key index, so each page costs in proportion to its size and the keys it skips.
+            Pages follow on correctly when keys are added or removed between calls
+        :param after: The key the previous page ended with. None for the first page
+        :param limit: int: The largest number of items on the page. At least 1
+        :param filter: callable: Optional. See iter_items()
+        :param stop: The end of the key range, excluded
+        :param start: The first key of the range, included, for the first page
+        :returns tuple: (list of (key, object) pairs, key to pass as after for the next page or None at the end).
+        With a filter the key is the last one examined, which need not be on the page
+        :raises ValueError: If limit is less than 1"""
+
+        if limit < 1:
+            raise ValueError(f'{type(self).__name__}(): page limit should be at least 1')
+        ordered = self._ordered()
+        if after is not None:
+            position = bisect_right(ordered, (uid_order(after), after))
+        else:
+            position = 0 if start is None else bisect_left(ordered, (uid_order(start),))
+        end = len(ordered) if stop is None else bisect_left(ordered, (uid_order(stop),))
+
+        items = []
+        while position < end and len(items) < limit:
+            key = ordered[position][1]
+            position += 1
+            obj = self.collection[key]
+            if filter is None or filter(obj):
+                items.append((key, obj))
+        return items, (ordered[position - 1][1] if position < end else None)
+
+
+@contextmanager
+def transaction(*stores):
+    """ Holds the file locks of stores in multi process mode and brings them up to date, so an operation that reads
+        and then saves them is not interleaved with another process's. Locks are taken in file name order so
+        processes locking the same stores can not deadlock. Does nothing for stores not in multi process mode
+    :param stores: _Aggregator() or Observer.Subject() instances"""
+
+    with ExitStack() as stack:
+        for store in sorted(stores, key=lambda store: store._filename):
+            stack.enter_context(store.lock())
+        for store in stores:
+            store.sync()
+        yield
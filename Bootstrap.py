@@ -0,0 +1,144 @@
+"""
+Parallel start up of the library stores.
+
+The stores do not depend on one another while loading, so their files are parsed concurrently in a process pool.
+A large bookloans.csv is split into newline aligned byte ranges that are parsed in separate processes and merged
+back in file order, which keeps each book-member loan list in date order. A store's JSON file is read whole by one
+worker: it is a single JSON object, possibly compressed, so it has no line breaks to split it at.
+Workers return plain rows and dictionaries and the objects are created as the results are merged. Plain data is far
+cheaper to pass back from a worker than the objects themselves, which would cost more to unpickle than to create.
+bootstrap() returns a per stage timing breakdown.
+"""
+
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from JsonIO import CustomDecode, json_filename, open_json
+from Library import BookItem
+from Loans import LoanItem
+from Membership import Member
+
+BOOK_FIELDS = ['uid', 'title', 'author', 'genre', 'subgenre', 'publisher']
+MEMBER_FIELDS = ['uid', 'first_name', 'last_name', 'gender', 'email', 'card_number']
+LOAN_FIELDS = ['book_uid', 'member_uid', 'start_date', 'return_date']
+CHUNK_SIZE = 4 * 1024 * 1024  # Bytes of bookloans.csv parsed by each worker
+
+
+def _parse_csv(filename, start=0, end=None, skip=0):
+    """
+    Parses a byte range of a csv file. Run in a worker process
+
+    :param filename: str: The csv file
+    :param start: int: Byte offset of the first line to parse
+    :param end: int: Byte offset after the last line. Defaults to the end of the file
+    :param skip: int: Number of lines to skip, for a heading row
+    :returns list: The rows, as lists of str, in file order
+    """
+
+    with open(filename, mode='rb') as file:
+        file.seek(start)
+        data = file.read() if end is None else file.read(end - start)
+    text = io.StringIO(data.decode('utf-8-sig' if start == 0 else 'utf-8'), newline='')
+    return list(csv.reader(text))[skip:]
+
+
+def _read_json(file, compression=None):
+    """ Reads a JSON file written by _JsonIO.save_to_file without creating objects. Run in a worker process.
+    JsonIO.read_json() is not used here: its incremental reader bounds the memory held while objects are created,
+    which a worker returning the whole file as plain data does not need, and json.load() is faster
+    :param file: str: The file name without a suffix
+    :param compression: None, 'gzip' or 'zstd'
+    :returns: The file's data as plain dictionaries and lists"""
+
+    with open_json(json_filename(file, compression), 'r', compression) as json_file:
+        return json.load(json_file)
+
+
+def _decode(value):
+    """ Creates the objects for the tagged dictionaries in value, as CustomDecode does while a file is read
+    :returns: value with the tagged dictionaries replaced by objects"""
+
+    if isinstance(value, dict):
+        return CustomDecode.dict_to_obj({key: _decode(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _chunks(filename, chunk_size):
+    """:returns list: (start, end) byte ranges of filename, each ending at a line break"""
+
+    size = os.path.getsize(filename)
+    ranges = []
+    start = 0
+    with open(filename, mode='rb') as file:
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline()  # Moves on to the end of the current line
+            end = min(file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def bootstrap(library, membership, loans, reservations=None, notify=None, csv_files=None, workers=None,
+              chunk_size=CHUNK_SIZE):
+    """
+    Loads the stores concurrently in a process pool.
+        With csv_files the stores are loaded from the csv files, otherwise each store is restored from its JSON file
+
+    :param library: Library() instance
+    :param membership: Membership() instance
+    :param loans: Loans() instance
+    :param reservations: Reservations() instance: Optional. Restored from JSON only
+    :param notify: Subject() instance: Optional. Restored from JSON only
+    :param csv_files: dict: Optional. Csv file names with the keys 'books', 'members' and 'loans'
+    :param workers: int: Number of worker processes. Defaults to the number of CPUs
+    :param chunk_size: int: Bytes of bookloans.csv given to each worker
+    :returns dict: Seconds taken by each stage. '<store>.parse' is the time until the store's data was ready,
+            '<store>.merge' the time to add it to the store, 'total' the overall time
+    """
+
+    timings = {}
+    began = time.perf_counter()
+    stores = {'books': library, 'members': membership, 'loans': loans, 'reservations': reservations,
+              'events': notify}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if csv_files:
+            jobs = {'books': [pool.submit(_parse_csv, csv_files['books'], skip=1)],
+                    'members': [pool.submit(_parse_csv, csv_files['members'], skip=1)],
+                    'loans': [pool.submit(_parse_csv, csv_files['loans'], start, end)
+                              for start, end in _chunks(csv_files['loans'], chunk_size)]}
+        else:
+            # Stamps are read before the files, so a save made while they are read leaves the stamp behind and
+            # the next sync() in multi process mode reads the file again
+            stamps = {name: store._read_stamp() for name, store in stores.items() if store is not None}
+            jobs = {name: [pool.submit(_read_json, store._filename, store.compression)]
+                    for name, store in stores.items() if store is not None}
+
+        creators = {'books': (BOOK_FIELDS, BookItem.create), 'members': (MEMBER_FIELDS, Member.create),
+                    'loans': (LOAN_FIELDS, LoanItem.create)}
+        for name, futures in jobs.items():
+            results = [future.result() for future in futures]
+            timings[f'{name}.parse'] = time.perf_counter() - began
+
+            start = time.perf_counter()
+            store = stores[name]
+            if csv_files:
+                fields, create = creators[name]
+                for rows in results:
+                    for row in rows:
+                        store.add(create(dict(zip(fields, row))))
+            elif name == 'events':
+                store._restored(results[0], stamps[name])
+            else:
+                # As restore() does, the versions, changed keys, stamp and the store's indexes are updated
+                store._restored(store._decode_keys(_decode(results[0])), stamps[name])
+            timings[f'{name}.merge'] = time.perf_counter() - start
+
+    timings['total'] = time.perf_counter() - began
+    return timings
@@ -0,0 +1,225 @@
+"""
+Classes to host several library branches, or partitions of one large catalogue, in a single process.
+
+Each Branch owns its own Library, Membership, Loans and Reservations instances (see _Singleton.branch_instance)
+and saves them in its own directory. The default singleton stores are left untouched, so single branch use of the
+system does not change. A BranchRouter sits in front of the branches' interfaces and answers cross branch lookups.
+"""
+
+import os
+
+from CsvIO import _CsvIO
+from Interface import LoansInterface, MembersInterface, ReservationInterface
+from Library import BookItem, Library
+from Loans import LoanItem, Loans
+from Membership import Membership
+from Observer import Subject
+from Reservations import Reservations
+
+
+class Branch:
+    def __init__(self, name, directory=None, membership=None, notify=None):
+        """
+        Creates, or fetches, the stores for one library branch and wires up its interfaces.
+            The stores are saved as JSON files in the branch's directory
+
+        :param name: str: The name of the branch
+        :param directory: str: Directory for the branch's files. Defaults to name
+        :param membership: Membership() instance: Optional membership shared with other branches
+        :param notify: Subject() instance: Optional notifications shared with other branches. A member is
+                unsubscribed from 'Loans' and 'Reservations' on this branch's own loans and reservations, so only
+                share one between branches whose members do not also borrow from the others
+        """
+
+        self.name = name
+        self.directory = directory or name
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Shared stores are saved and restored by the branch that created them
+        self._shared = [store for store in (membership, notify) if store is not None]
+
+        self.library = self._store(Library, 'books')
+        self.membership = membership if membership is not None else self._store(Membership, 'members')
+        self.loans = self._store(Loans, 'loans')
+        if notify is None:
+            notify = Subject(self.membership)
+            notify.filename = self.path('events')
+            notify.add_events('Loans', 'Reservations', 'NewCards')
+        self.notify = notify
+        self.reservations = self._store(Reservations, 'reservations', self.library, self.membership, self.notify)
+
+        self.loans_interface = LoansInterface(self.loans, self.membership, self.library, self.reservations,
+                                              self.notify)
+        self.members_interface = MembersInterface(self.membership, self.notify)
+        self.members_interface.filename = self.path('new_members')
+        self.reservation_interface = ReservationInterface(self.reservations, self.membership, self.library)
+
+    def __str__(self):
+        return f'Branch({self.name}: {len(self.library)} books, {len(self.membership)} members)'
+
+    def _store(self, cls, filename, *args):
+        """:returns: The branch's instance of cls. A new instance is given its own collection and filename"""
+
+        new = not cls.branch_exists(self.name)
+        store = cls.branch_instance(self.name, *args)
+        if new:
+            store.reset()
+            store.set_filename(self.path(filename))
+        return store
+
+    def path(self, filename):
+        """:returns str: filename (without suffix) within the branch's directory"""
+        return os.path.join(self.directory, filename)
+
+    def stores(self):
+        """:returns list: The branch's own stores that are saved and restored"""
+        return [store for store in (self.library, self.membership, self.loans, self.reservations, self.notify)
+                if store not in self._shared]
+
+    def save(self):
+        """ Saves all of the branch's stores """
+        for store in self.stores():
+            store.save()
+
+    def restore(self):
+        """ Restores all of the branch's stores from its directory """
+        for store in self.stores():
+            store.restore()
+
+
+class BranchRouter:
+    def __init__(self, *branches, partitioned=False):
+        """
+        Routes requests to the branch that holds the book or member.
+
+        :param branches: Branch() instances
+        :param partitioned: Bool: True if the branches are uid hash partitions of one catalogue.
+                Books are then routed by int(book_uid) % the number of branches instead of being searched for
+        """
+
+        self.branches = {branch.name: branch for branch in branches}
+        self._order = list(branches)
+        self.partitioned = partitioned
+
+    @classmethod
+    def partitions(cls, count, directory='partitions'):
+        """
+        Creates a router over count partitions of one catalogue.
+            The partitions share a single membership so any member can borrow any book. Each has its own
+            notification subject, as a member's loans and reservations may be spread over several partitions
+
+        :param count: int: The number of partitions
+        :param directory: str: Parent directory for the partitions' files
+        :returns: BranchRouter() instance
+        """
+
+        first = Branch('part0', os.path.join(directory, 'part0'))
+        branches = [first] + [Branch(f'part{n}', os.path.join(directory, f'part{n}'),
+                                     first.membership) for n in range(1, count)]
+        return cls(*branches, partitioned=True)
+
+    def branch(self, name):
+        """:returns: The Branch() with the name
+        :raises KeyError: If there is no such branch"""
+        return self.branches[name]
+
+    def partition(self, uid):
+        """:returns: The Branch() holding uid in a partitioned catalogue"""
+        return self._order[int(uid) % len(self._order)]
+
+    def load_csv(self, books, members, loans):
+        """
+        Loads the csv files into a partitioned catalogue. Each book and its loans are added to the partition
+            for the book's uid. Members are added once, to the shared membership
+
+        :param books: str: Name of the books csv file
+        :param members: str: Name of the members csv file
+        :param loans: str: Name of the loans csv file
+        """
+
+        for line in _CsvIO.read_csv(books, Start_line='1', Fields=[
+                'uid', 'title', 'author', 'genre', 'subgenre', 'publisher']):
+            self.partition(line['uid']).library.add(BookItem.create(line))
+        self._order[0].membership.read_csv(members, Start_line='1', Fields=[
+            'uid', 'first_name', 'last_name', 'gender', 'email', 'card_number'])
+        for line in _CsvIO.read_csv(loans, Start_line='0', Fields=[
+                'book_uid', 'member_uid', 'start_date', 'return_date']):
+            self.partition(line['book_uid']).loans.add(LoanItem.create(line))
+
+    def book_branch(self, book_uid):
+        """
+        :param book_uid: int as str
+        :returns: The Branch() whose catalogue holds the book, or None if no branch has it
+        """
+
+        if self.partitioned:
+            branch = self.partition(book_uid)
+            return branch if book_uid in branch.library.collection else None
+        for branch in self._order:
+            if book_uid in branch.library.collection:
+                return branch
+        return None
+
+    def find_book(self, book_uid):
+        """
+        Cross branch lookup of a book
+
+        :param book_uid: int as str
+        :returns: list of tuples: (branch name, BookItem()) for every branch holding a book with the uid
+        """
+
+        branches = [self.partition(book_uid)] if self.partitioned else self._order
+        return [(branch.name, branch.library.collection[book_uid]) for branch in branches
+                if book_uid in branch.library.collection]
+
+    def find_member(self, member_uid):
+        """
+        Cross branch lookup of a member
+
+        :param member_uid: int as str
+        :returns: list of tuples: (branch name, Member()) for every branch the member belongs to
+        """
+
+        return [(branch.name, branch.membership.collection[member_uid]) for branch in self._order
+                if member_uid in branch.membership.collection]
+
+    def _by_branch(self, books):
+        """:returns dict: Branch() -> list of the books it holds. Books held by no branch are reported"""
+        grouped = {}
+        for book in books:
+            branch = self.book_branch(book.scan())
+            if branch is None:
+                print(f'{book.title}: does not belong to any branch')
+            else:
+                grouped.setdefault(branch, []).append(book)
+        return grouped
+
+    def checkout_books(self, member_of_public, *presented_books):
+        """ Checks out the presented books through the interface of the branch holding each book.
+            See LoansInterface.checkout_books()"""
+        for branch, books in self._by_branch(presented_books).items():
+            branch.loans_interface.checkout_books(member_of_public, *books)
+
+    def return_books(self, *presented_books):
+        """ Returns books to the branches they belong to, whichever branch they were handed in at.
+            See LoansInterface.return_book_drop()"""
+        for branch, books in self._by_branch(presented_books).items():
+            branch.loans_interface.return_book_drop(*books)
+
+    def make_reservation(self, member_of_public, book_uid):
+        """ Reserves a book at the branch holding it. See ReservationInterface.make_reservation()
+        :raises Exception: If no branch holds the book"""
+        branch = self.book_branch(book_uid)
+        if branch is None:
+            raise Exception(f'Invalid key: {book_uid} does not exist')
+        branch.reservation_interface.make_reservation(member_of_public, book_uid)
+
+    def save(self):
+        """ Saves every branch """
+        for branch in self._order:
+            branch.save()
+
+    def restore(self):
+        """ Restores every branch """
+        for branch in self._order:
+            branch.restore()
@@ -0,0 +1,341 @@
+"""
+Read only views of the Library and Membership held in shared memory, for worker processes that browse the catalogue
+or check availability without restoring their own copy of the stores.
+
+The writer exports a store once into a multiprocessing.shared_memory segment:
+
+    header      class tag, number of records, record size and the offset of the string table
+    keys        the numeric value of each uid, in record order, for binary search without decoding the uids
+    records     one fixed width record per object in uid_order(): a state word followed by the offset and length
+                of each field in the string table
+    strings     the UTF-8 text of the fields. Repeated values, such as genres and publishers, are stored once
+
+Workers attach to the segment by name. Lookups binary search the records, so no per process index is built. The
+state word, a book's status or a member's number of loans, is the only part updated after export. The writer
+publishes changes to it in place, with publish() or from a Changes.ChangeStream, and every attached view sees them
+at once. Objects added to the store after the export need a new export.
+"""
+
+import struct
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from multiprocessing import resource_tracker, shared_memory
+
+from Aggregator import uid_order
+from Library import BookItem
+from Membership import Member
+
+HEADER = struct.Struct('<8sIII4x')  # class tag, number of records, record size, offset of the string table
+STATE = struct.Struct('<i')  # Signed, as a member's number of loans can fall below 0
+KEY = struct.Struct('<Q')
+_ATTACHING = threading.Lock()  # Serialises the resource tracker change made by _SharedTable.attach()
+NOT_NUMERIC = 2 ** 64 - 1  # Key of a uid that is not a number, or too large for a key. Sorts last as in uid_order()
+
+
+def _key(uid):
+    """:returns int: The value stored in the keys section for uid"""
+    if uid.isdigit() and int(uid) < NOT_NUMERIC:
+        return int(uid)
+    return NOT_NUMERIC
+
+
+class _SharedTable(ABC):
+    """ Base class for the shared views. Subclasses set FIELDS, the string attributes exported, STATE_FIELD, the
+        attribute kept in the state word, ENTITY, the class name used in change streams, and provide _encode() and
+        _decode() for the state and _make() to build an object from a record """
+
+    TAG = b''  # Marks the segments exported by the class
+    FIELDS = ()
+    STATE_FIELD = ''
+    ENTITY = ''
+
+    def __init__(self, shm, owner):
+        """
+        Use export() or attach() rather than instantiating directly
+
+        :param shm: shared_memory.SharedMemory() instance
+        :param owner: bool: True for the writer, which may publish() and unlink()
+        """
+
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self._buf = shm.buf if owner else shm.buf.toreadonly()
+        tag, self._count, self._size, self._strings = HEADER.unpack_from(self._buf, 0)
+        if tag != self.TAG:
+            self.close()
+            raise ValueError(f'{self.name} is not a shared {type(self).__name__}')
+        self._records = HEADER.size + KEY.size * self._count
+        self._keys = self._buf[HEADER.size:self._records].cast('Q')
+        self._cursor = None
+
+    @classmethod
+    def export(cls, store, name=None):
+        """
+        Writes the objects of a store to a new shared memory segment
+
+        :param store: Library() or Membership() instance, to match the class
+        :param name: str: Optional name of the segment. A unique name is chosen if None
+        :returns: The writer's view of the segment. Pass its name to attach() in the workers
+        """
+
+        strings = {}  # text -> (offset, length) in the string table
+        table = bytearray()
+        rows = []
+        uids = store.keys_in_order()
+        for uid in uids:
+            obj = store.collection[uid]
+            row = [cls._encode(getattr(obj, cls.STATE_FIELD))]
+            for field in cls.FIELDS:
+                text = str(getattr(obj, field))
+                if text not in strings:
+                    data = text.encode('utf-8')
+                    strings[text] = (len(table), len(data))
+                    table += data
+                row.extend(strings[text])
+            rows.append(row)
+
+        record = struct.Struct(STATE.format + 'II' * len(cls.FIELDS))
+        records = HEADER.size + KEY.size * len(rows)
+        offset = records + record.size * len(rows)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=offset + len(table))
+        HEADER.pack_into(shm.buf, 0, cls.TAG, len(rows), record.size, offset)
+        for index, (uid, row) in enumerate(zip(uids, rows)):
+            KEY.pack_into(shm.buf, HEADER.size + index * KEY.size, _key(uid))
+            record.pack_into(shm.buf, records + index * record.size, *row)
+        shm.buf[offset:offset + len(table)] = table
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Opens a read only view of a segment made by export(), in this or another process
+
+        :param name: str: The name of the segment
+        :returns: The view
+        :raises FileNotFoundError: If there is no such segment
+        """
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            # Earlier versions register every segment opened with the resource tracker, which removes it when the
+            # process exits. Only the writer should remove the segment, so registering is skipped for this segment
+            # alone, and only while it is opened
+            register = resource_tracker.register
+
+            def register_others(resource, rtype):
+                if rtype != 'shared_memory' or resource.lstrip('/') != name.lstrip('/'):
+                    register(resource, rtype)
+
+            with _ATTACHING:
+                resource_tracker.register = register_others
+                try:
+                    shm = shared_memory.SharedMemory(name=name)
+                finally:
+                    resource_tracker.register = register
+        return cls(shm, False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, uid):
+        return self._find(uid) is not None
+
+    def __iter__(self):
+        """ Iterates over the uids in uid_order()"""
+        for index in range(self._count):
+            yield self._text(index, 0)
+
+    def close(self):
+        """ Releases this process's view. The segment remains for the others"""
+        if hasattr(self, '_keys'):
+            self._keys.release()
+        self._buf.release()
+        self._shm.close()
+
+    def unlink(self):
+        """ Removes the segment once every process has closed it. Writer only"""
+        self._shm.unlink()
+
+    def _offset(self, index):
+        return self._records + index * self._size
+
+    def _text(self, index, field):
+        """:returns str: Field number field of the record at index"""
+        start, length = struct.unpack_from('<II', self._buf, self._offset(index) + STATE.size + 8 * field)
+        start += self._strings
+        return str(self._buf[start:start + length], 'utf-8')
+
+    def _find(self, uid):
+        """:returns int: The index of the record for uid, or None"""
+        key = _key(uid)
+        index = bisect_left(self._keys, key)
+        if key != NOT_NUMERIC:
+            # Uids with leading zeros share a key
+            while index < self._count and self._keys[index] == key:
+                if self._text(index, 0) == uid:
+                    return index
+                index += 1
+            return None
+
+        target = uid_order(uid)
+        low, high = index, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if uid_order(self._text(middle, 0)) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._text(low, 0) == uid:
+            return low
+        return None
+
+    def _index(self, uid):
+        index = self._find(uid)
+        if index is None:
+            raise Exception(f'Invalid key: {uid} does not exist')
+        return index
+
+    def state(self, uid):
+        """:returns: The current value of the state field of the object with uid"""
+        return self._decode(STATE.unpack_from(self._buf, self._offset(self._index(uid)))[0])
+
+    def search(self, uid):
+        """
+        :param uid: int as str: The unique id of the object
+        :returns: A new object built from the record. Later status updates are not reflected in it
+        :raises Exception: If uid is not in the view, as _Aggregator.search()
+        """
+
+        index = self._index(uid)
+        attributes = {field: self._text(index, number) for number, field in enumerate(self.FIELDS)}
+        attributes[self.STATE_FIELD] = self._decode(STATE.unpack_from(self._buf, self._offset(index))[0])
+        return self._make(attributes)
+
+    def publish(self, uid, value):
+        """
+        Updates the state field of an object for every attached view. Writer only
+
+        :param uid: int as str
+        :param value: The new value of the state field
+        :returns bool: False if uid was not exported
+        """
+
+        index = self._find(uid)
+        if index is None:
+            return False
+        STATE.pack_into(self._buf, self._offset(index), self._encode(value))
+        return True
+
+    def follow(self, stream, since=None):
+        """
+        Publishes the state changes read from a change stream on each refresh(). Writer only
+
+        :param stream: Changes.ChangeStream() instance
+        :param since: int: Sequence number to read after. Defaults to the stream's current position
+        """
+
+        self._cursor = stream.cursor(since)
+
+    def refresh(self):
+        """
+        Publishes the changes to the state field made since the last refresh, read from the stream given to follow()
+
+        :returns int: The number of changes published
+        :raises LookupError: If the stream no longer buffers some of the changes. Export again
+        """
+
+        count = 0
+        if self._cursor is not None:
+            # The cursor is moved past a change only once it has been published, so a change that fails to
+            # publish is read again on the next refresh rather than lost
+            while True:
+                change = self._cursor.stream.after(self._cursor.seq)
+                if change is None:
+                    break
+                if (change.entity == self.ENTITY and change.kind == 'status' and self.STATE_FIELD in change.data
+                        and self.publish(change.key, change.data[self.STATE_FIELD])):
+                    count += 1
+                self._cursor.seq = change.seq
+        return count
+
+    @classmethod
+    @abstractmethod
+    def _encode(cls, value):
+        """:returns int: The state word for a value of the state field"""
+
+    @classmethod
+    @abstractmethod
+    def _decode(cls, code):
+        """:returns: The value of the state field for a state word"""
+
+    @classmethod
+    @abstractmethod
+    def _make(cls, attributes):
+        """:returns: An object of the store's class built from an attributes dict, as its create() method"""
+
+
+class SharedCatalogue(_SharedTable):
+    """ Read only view of a Library() in shared memory. The books' statuses are kept up to date by the writer """
+
+    TAG = b'BOOKS001'
+    FIELDS = ('uid', 'title', 'author', 'genre', 'sub_genre', 'publisher')
+    STATE_FIELD = 'status'
+    ENTITY = 'BookItem'
+    STATUSES = ('Available', 'On loan', 'Reserved')
+
+    def status(self, uid):
+        """:returns str: The book's current status"""
+        return self.state(uid)
+
+    def is_available(self, uid):
+        """:returns Bool: True if the book's current status is Available"""
+        return self.state(uid) == 'Available'
+
+    @classmethod
+    def _encode(cls, value):
+        return cls.STATUSES.index(value)
+
+    @classmethod
+    def _decode(cls, code):
+        return cls.STATUSES[code]
+
+    @staticmethod
+    def _make(attributes):
+        return BookItem.create(attributes)
+
+
+class SharedMembers(_SharedTable):
+    """ Read only view of the public fields of a Membership() in shared memory. Contact details and fines are
+        not exported. The members' numbers of loans are kept up to date by the writer """
+
+    TAG = b'MEMBERS1'
+    FIELDS = ('uid', 'first_name', 'last_name', 'card_number')
+    STATE_FIELD = 'no_of_loans'
+    ENTITY = 'Member'
+
+    def loans(self, uid):
+        """:returns int: The member's current number of loans"""
+        return int(self.state(uid))
+
+    @staticmethod
+    def _encode(value):
+        return int(value)
+
+    @staticmethod
+    def _decode(code):
+        return str(code)
+
+    @staticmethod
+    def _make(attributes):
+        return Member.create(attributes)
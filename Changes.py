@@ -0,0 +1,182 @@
+"""
+Change data capture for the stores.
+
+While a ChangeStream is started, the stores and the BookItem / Member setters emit a typed Change for each mutation:
+
+    insert      A record added to a store
+    status      A book's status or a member's number of loans changed
+    fine        A member's fines changed
+    loan_open   A loan started
+    loan_close  A loan ended
+
+Changes carry increasing sequence numbers. They can be read in process with a cursor, and can also be appended to a
+newline delimited JSON log for consumers in other processes, so downstream mirrors can be kept up to date
+incrementally instead of re-reading whole JSON files. emit() returns at once when no stream is started.
+"""
+
+import json
+import os
+from collections import deque, namedtuple
+
+from Singleton import _Singleton
+
+KINDS = ('insert', 'status', 'fine', 'loan_open', 'loan_close')
+
+Change = namedtuple('Change', ['seq', 'kind', 'entity', 'key', 'data'])
+Change.__doc__ = """ A single mutation.
+    seq: int: Sequence number, increasing by one per change
+    kind: str: One of KINDS
+    entity: str: The class of the record changed, e.g. 'BookItem'
+    key: str: The record's key in its store
+    data: dict: The changed values, or the whole record for an insert"""
+
+_stream = None  # The started ChangeStream, if any
+
+
+def emit(kind, entity, key, data):
+    """ Adds a change to the started stream. Does nothing when no stream is started
+    :param kind: str: One of KINDS
+    :param entity: str: The class of the record changed
+    :param key: str: The record's key in its store. A tuple compound key is joined with '-'
+    :param data: dict: The changed values, or the record itself for its as_json_dict() to be captured.
+            Passing the record avoids building the dictionary while no stream is started"""
+
+    if _stream is not None:
+        if not isinstance(key, str):
+            key = '-'.join(key)
+        if hasattr(data, 'as_json_dict'):
+            data = data.as_json_dict()
+        _stream.append(kind, entity, key, data)
+
+
+class _Cursor:
+    """ Iterator over the changes after a sequence number. Stops when it has caught up with the stream and can be
+        iterated again later to continue from where it stopped """
+
+    def __init__(self, stream, seq):
+        self.stream = stream
+        self.seq = seq
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        change = self.stream.after(self.seq)
+        if change is None:
+            raise StopIteration
+        self.seq = change.seq
+        return change
+
+
+class ChangeStream(_Singleton):
+    """
+    The stream of changes. Inherits Singleton properties.
+
+        seq: int: Sequence number of the last change
+        buffer: deque: The most recent changes, for in process cursors
+        log: str: Name of the newline delimited JSON log the changes are appended to, or None
+    """
+
+    seq = 0
+    buffer = deque()
+    log = None
+    _log_file = None
+
+    def start(self, log=None, buffer_size=100000):
+        """
+        Starts capturing changes
+
+        :param log: str: Optional newline delimited JSON file to append changes to.
+                If the file exists the sequence numbers continue from its last change
+        :param buffer_size: int: Number of recent changes kept for in process cursors
+        """
+
+        global _stream
+        self.stop()
+        self.buffer = deque(maxlen=buffer_size)
+        if log is not None:
+            last = self._last_logged(log)
+            self.seq = max(self.seq, last.seq if last else 0)
+            self._log_file = open(log, mode='a', encoding='utf-8', buffering=1)  # Line buffered
+        self.log = log
+        _stream = self
+
+    def stop(self):
+        """ Stops capturing changes and closes the log """
+
+        global _stream
+        if _stream is self:
+            _stream = None
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def append(self, kind, entity, key, data):
+        """ Records a change. See emit()
+        :returns: The Change()"""
+
+        self.seq += 1
+        change = Change(self.seq, kind, entity, key, data)
+        self.buffer.append(change)
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(change._asdict()) + '\n')
+        return change
+
+    def after(self, seq):
+        """
+        :param seq: int: A sequence number
+        :returns: The Change() following seq, or None if there is none yet
+        :raises LookupError: If that change is no longer in the buffer. Read it from the log instead
+        """
+
+        if seq >= self.seq:
+            return None
+        first = self.buffer[0].seq if self.buffer else self.seq + 1
+        if seq + 1 < first:
+            raise LookupError(f'ChangeStream(): change {seq + 1} is no longer buffered')
+        return self.buffer[seq + 1 - first]
+
+    def cursor(self, since=None):
+        """
+        :param since: int: Sequence number to read after. Defaults to the current position, so only new changes
+                are returned
+        :returns: _Cursor(): An iterator over the changes after since
+        """
+
+        return _Cursor(self, self.seq if since is None else since)
+
+    @staticmethod
+    def read_log(log, since=0):
+        """
+        Reads changes from a log written by a stream
+
+        :param log: str: The newline delimited JSON file
+        :param since: int: Only changes after this sequence number are returned
+        :returns generator: Change() instances in sequence order
+        """
+
+        with open(log, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    change = Change(**json.loads(line))
+                    if change.seq > since:
+                        yield change
+
+    @staticmethod
+    def _last_logged(log):
+        """:returns: The last Change() in a log, or None if the log is empty or does not exist"""
+
+        if not os.path.exists(log):
+            return None
+        with open(log, mode='rb') as file:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            block = 4096
+            while True:
+                file.seek(max(0, size - block))
+                lines = file.read().splitlines()
+                if len(lines) > 1 or block >= size:
+                    break
+                block *= 2
+        lines = [line for line in lines if line.strip()]
+        return Change(**json.loads(lines[-1])) if lines else None
@@ -1,7 +1,5 @@
 """Class to provide read functionality with the provided csv files."""
 
-import csv
-
 
 class _CsvIO:
     """Mixin class to provide a static method to read from a CSV file.
@@ -24,6 +22,8 @@ class _CsvIO:
 
         :returns:  a list of dictionaries (each relating to a row in the csv)."""
 
+        import csv  # Imported when needed as stores restored from JSON never read a csv file
+
         if len(kwargs) > 2 or (len(kwargs) == 2
                                and ('Start_line' not in kwargs or 'Fields' not in kwargs)):
             raise Exception("Invalid  key arguments ")
@@ -1,10 +1,18 @@
 import time
-import calendar
+from functools import lru_cache
+
+AS_DATE_CACHE_SIZE = 4096  # Number of Excel date to 'dd/mm/yyyy' conversions kept by as_date()
 
 
 class Date:
     """ Class to hold a single date. Includes methods to convert between the Microsoft Excel format
-    and the typical str format d/m/y """
+    and the typical str format d/m/y
+
+    Class Attributes:
+    :clock: function: Returns the current time in seconds since the O.S. epoch. Replaceable with a fake clock
+            for tests and load replays """
+
+    clock = time.time
 
     def __init__(self, date='default'):
         """ :param date: int: Excel format - represents the Number of days since 1/1/1900.
@@ -22,6 +30,7 @@ class Date:
         return self.date
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def _diff_in_days():
         """ Operating systems having different epoch standards.
             Unix: 1/1/1970
@@ -47,14 +56,16 @@ class Date:
         # + 1 day : Excel counts 1/1/1900 as day 1 and not day 0
         return (SYSTEM_EPOCH - 1900) * 365 + leap_days + 1
 
-    def _system_to_excel(self, date=time.time()):
+    def _system_to_excel(self, date=None):
         """ Calculates a date in Excel format
         :param date: int:  number of secs since the o.s. epoch.
-            If no arg passed then the current date is found
+            If no arg passed then the current date is found from Date.clock
         :returns int: The number of seconds since 1/1/1900.
             Adds 1 day if the date is after 28/02/1900 as Excel incorrectly
             calculates 1900 as a leap year"""
 
+        if date is None:
+            date = Date.clock()
         no_of_days = int(date / (60 * 60 * 24)) + self._diff_in_days()
 
         # 29/02/1900 = day 59 - adjustment if the date is before the first recorded leap day
@@ -78,6 +89,8 @@ class Date:
             :param date: str: in the form of dd/mm/yyyy ex.('20/12/2000')
             :raises ValueException: If the arg is not in the correct format"""
 
+        import calendar  # Imported here as it is slow to import and only needed to convert dates entered by hand
+
         try:
             date_val = calendar.timegm(time.strptime(date, '%d/%m/%Y'))
             self.date = str(self._system_to_excel(date_val))
@@ -88,10 +101,19 @@ class Date:
 
     def as_date(self):
         """ :returns self.date as a string in 'dd/mm/yyyy' format
+         Conversions are cached as the same dates are formatted repeatedly for loans and reservations """
+
+        return self._excel_to_str(int(self.date))
+
+    @staticmethod
+    @lru_cache(maxsize=AS_DATE_CACHE_SIZE)
+    def _excel_to_str(date):
+        """ :param date: int: Excel format date
+        :returns str: date in 'dd/mm/yyyy' format
          An adjustment of one less day is made if the date is before 29/02/1900  """
 
-        no_of_days = (int(self.date) - self._diff_in_days())
-        if int(self.date) > 59:  # > 28/02/1900
+        no_of_days = (date - Date._diff_in_days())
+        if date > 59:  # > 28/02/1900
             no_of_days -= 1
         tse_in_secs = no_of_days * (60 * 60 * 24)  # tse: time since epoch
         return time.strftime("%d/%m/%Y", (time.gmtime(tse_in_secs)))
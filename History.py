@@ -0,0 +1,184 @@
+"""
+Point in time queries over the loan history.
+
+LoanHistory indexes every LoanItem as the interval [start_date, return_date], with open loans running on
+indefinitely. It answers "who had book X on date D", "what was on loan on date D" and "what was on loan between
+two dates" in logarithmic time plus the number of loans reported, for audits and for replaying historical state.
+"""
+
+from bisect import bisect_right
+
+from DateStamp import Date
+
+OPEN = float('inf')  # End of the interval for a loan that has not been returned
+
+
+def _as_val(date):
+    """:param date: int (Excel format), Date() or str ('dd/mm/yyyy')
+    :returns int: The date in Excel format"""
+
+    if isinstance(date, Date):
+        return date.as_val()
+    if isinstance(date, str):
+        converted = Date(0)
+        converted.set_date(date)
+        return converted.as_val()
+    return date
+
+
+def _interval(loan_item):
+    """:returns tuple: (start, end, loan_item) for a LoanItem"""
+
+    end = loan_item.return_date.as_val()
+    return loan_item.start_date.as_val(), end if end else OPEN, loan_item
+
+
+class _IntervalNode:
+    """ Node of a centered interval tree. Holds the intervals that contain its center point, sorted both by
+        start and by end, with the intervals wholly before and after the center in the left and right subtrees"""
+
+    def __init__(self, intervals):
+        points = sorted(point for start, end, _ in intervals for point in (start, end))
+        self.center = points[len(points) // 2]
+
+        here, before, after = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                before.append(interval)
+            elif interval[0] > self.center:
+                after.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = _IntervalNode(before) if before else None
+        self.right = _IntervalNode(after) if after else None
+
+    def overlapping(self, start, end, found):
+        """ Appends the loans of intervals that overlap [start, end] to found """
+
+        node = self
+        while node is not None:
+            if end < node.center:
+                for interval in node.by_start:
+                    if interval[0] > end:
+                        break
+                    found.append(interval[2])
+                node = node.left
+            elif start > node.center:
+                for interval in node.by_end:
+                    if interval[1] < start:
+                        break
+                    found.append(interval[2])
+                node = node.right
+            else:
+                # Every interval here contains the center, which lies within [start, end]
+                found.extend(interval[2] for interval in node.by_start)
+                if node.left is not None:
+                    node.left.overlapping(start, end, found)
+                node = node.right
+
+
+class LoanHistory:
+    def __init__(self, loan_items=()):
+        """
+        Interval index over loans.
+            The index is built on the first query after loans are added. Call refresh() after loans are returned
+            so their return dates are picked up
+
+        :param loan_items: iterable of LoanItem() instances
+        """
+
+        self._loans = list(loan_items)
+        self._tree = None
+        self._by_book = None
+
+    @classmethod
+    def from_loans(cls, loans):
+        """
+        :param loans: Loans() instance
+        :returns: LoanHistory() of every loan in the store, including those archived
+        """
+
+        return cls(loans.history())
+
+    def __len__(self):
+        return len(self._loans)
+
+    def add(self, *loan_items):
+        """ Adds loans to the history. The index is rebuilt on the next query
+        :param loan_items: LoanItem() instances"""
+
+        self._loans.extend(loan_items)
+        self.refresh()
+
+    def refresh(self):
+        """ Discards the index so it is rebuilt, with current return dates, on the next query """
+
+        self._tree = None
+        self._by_book = None
+
+    def _build(self):
+        """ Builds the interval tree and the per book start date index """
+
+        intervals = [_interval(loan_item) for loan_item in self._loans]
+        self._tree = _IntervalNode(intervals) if intervals else None
+
+        by_book = {}
+        for interval in sorted(intervals, key=lambda item: item[0]):
+            starts, books = by_book.setdefault(interval[2].book_uid, ([], []))
+            starts.append(interval[0])
+            books.append(interval)
+        self._by_book = by_book
+
+    def holder_on(self, book_uid, date):
+        """
+        Finds who had a book on loan on a date. Loans of a book do not overlap, so only the last loan
+            to start on or before the date needs checking
+
+        :param book_uid: int as str
+        :param date: int (Excel format), Date() or str ('dd/mm/yyyy')
+        :return: int as str or None: The uid of the member who had the book, None if it was not on loan
+        """
+
+        if self._by_book is None:
+            self._build()
+        date = _as_val(date)
+        starts, intervals = self._by_book.get(book_uid, ([], []))
+        index = bisect_right(starts, date) - 1
+        if index >= 0 and intervals[index][1] >= date:
+            return intervals[index][2].member_uid
+        return None
+
+    def on_loan_between(self, start, end):
+        """
+        :param start: int (Excel format), Date() or str ('dd/mm/yyyy')
+        :param end: int (Excel format), Date() or str ('dd/mm/yyyy')
+        :return: List of LoanItem(): Loans that were open at any time from start to end inclusive
+        """
+
+        if self._by_book is None:
+            self._build()
+        found = []
+        if self._tree is not None:
+            self._tree.overlapping(_as_val(start), _as_val(end), found)
+        return found
+
+    def on_loan_at(self, date):
+        """
+        :param date: int (Excel format), Date() or str ('dd/mm/yyyy')
+        :return: List of LoanItem(): Loans that were open on the date
+        """
+
+        return self.on_loan_between(date, date)
+
+    def state_at(self, date):
+        """
+        Replays the loan state of the library on a date
+
+        :param date: int (Excel format), Date() or str ('dd/mm/yyyy')
+        :return: dict: book_uid -> member_uid for every book on loan on the date
+        """
+
+        return {loan_item.book_uid: loan_item.member_uid for loan_item in self.on_loan_at(date)}
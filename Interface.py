@@ -1,8 +1,9 @@
+from Aggregator import transaction
 from JsonIO import _JsonIO
-from Library import BookItem
-from Membership import Membership, Member
-from Notifications import CardNotification, FineNotification
-from Observer import Subject
+from DateStamp import Date
+from Notifications import CardNotification, FineNotification, OverdueNotification
+# The store modules are imported where they are used. Callers pass in the stores, so the modules are already
+# loaded by then, and importing Interface does not load every store
 
 
 class MembersInterface(_JsonIO):
@@ -13,6 +14,8 @@ class MembersInterface(_JsonIO):
             :param notify: Subject() instance that deals with notifications on Event triggers
 
             :raises TypeError: if membership or notify are not the correct type of object"""
+        from Membership import Membership
+        from Observer import Subject
 
         if isinstance(membership, Membership):
             self.membership = membership
@@ -35,11 +38,10 @@ class MembersInterface(_JsonIO):
     def restore(self, file=''):
         """Restores new_members from a JSON file
         :raises FileNotFound; If the backup file does not exist"""
-        backup = self.new_members.copy()
         try:
             self.new_members = super().restore(self.filename)
         except FileNotFoundError:
-            self.new_members = backup
+            # self.new_members is only replaced once the file has been read, so is left as it was
             print(f'Unable to restore from file {self.filename}')
 
     def _make_json_dict(self):
@@ -54,18 +56,21 @@ class MembersInterface(_JsonIO):
             :param kwargs: Should match Member attribute keywords
             first_name = ' ',last_name = ' ', gender = ' ', email = ' '
         """
-        new_mem = Member().create(kwargs)
-        new_mem.uid = self.membership.next_id()
+        from Membership import Member
 
-        self.membership.add(new_mem)
-        self.membership.save()
-        self.new_members.append(new_mem)
+        with transaction(self.membership):
+            new_mem = Member().create(kwargs)
+            new_mem.uid = self.membership.next_id()
 
-        # Add them to the NewCard event
-        self.notify.register('NewCards', new_mem.uid)
+            self.membership.add(new_mem)
+            self.membership.save()
+            self.new_members.append(new_mem)
 
-        self.save()
-        self.restore()
+            # Add them to the NewCard event
+            self.notify.register('NewCards', new_mem.uid)
+
+            self.save()
+            self.restore()
 
     def new_member_list(self):
         """
@@ -89,30 +94,28 @@ class MembersInterface(_JsonIO):
 
         :param args: list of member_ids in string format who have new cards.
         """
-        for member_uid in args:
-            member = self.membership.search(member_uid)
-            # gets the last digit in card_number and adds 1
-            member.card_number = member.uid + str(int(member.card_number[-1]) + 1)
+        with transaction(self.membership):
+            for member_uid in args:
+                member = self.membership.search(member_uid)
+                # gets the last digit in card_number and adds 1
+                member.card_number = member.uid + str(int(member.card_number[-1]) + 1)
+                self.membership.touch(member.uid)
 
-            print('\n', '-' * 70)
-            print('Console')
-            print(f'\nCard details for {member.first_name} {member.last_name} '
-                  f'have been updated with card number: {member.card_number}')
+                print('\n', '-' * 70)
+                print('Console')
+                print(f'\nCard details for {member.first_name} {member.last_name} '
+                      f'have been updated with card number: {member.card_number}')
 
-            # Notifications
-            print('member card notice')
-            self.notify.send_email('NewCards', CardNotification(member))
+                # Notifications
+                print('member card notice')
+                self.notify.send_email('NewCards', CardNotification(member))
 
-        self.membership.save()
+            self.membership.save()
 
     def waiting_for_card(self):
-        """:returns: List of str: A list of the member ids who are waiting for a card to be issued."""
+        """:returns: List of str: A list of the member ids who are waiting for a card to be issued, in uid order."""
 
-        card_lst = []
-        for uid in self.membership.all_members():
-            if self.membership.all_members()[uid].card_number == '0':
-                card_lst.append(str(uid))
-        return card_lst
+        return [uid for uid, _ in self.membership.iter_items(lambda member: member.card_number == '0')]
 
 
 class LoansInterface:
@@ -151,7 +154,7 @@ class LoansInterface:
             return True
         return False
 
-    def _fine_due(self, book, member):
+    def _fine_due(self, book, member, notices=None):
         """
         Retrieves the last recorded loan between member and book and calculates the fine for an overdue book.
         Prints to the console and sends a Notification to the member
@@ -160,6 +163,7 @@ class LoansInterface:
             Saves the membership data
         :param book: A Book Instance
         :param member: A member Instance
+        :param notices: list: Optional. The FineNotification is appended to notices instead of being sent
         """
 
         last_loan = self.loans.search(book.uid, member.uid)[-1]
@@ -175,7 +179,50 @@ class LoansInterface:
         member.add_fine(fine)
 
         # Send Notification
-        self.notify.send_email('Loans', FineNotification(member, book, days_over_due, fine))
+        notice = FineNotification(member, book, days_over_due, fine)
+        if notices is None:
+            self.notify.send_email('Loans', notice)
+        else:
+            notices.append(notice)
+
+    def overdue_sweep(self, today=None, batch_size=100):
+        """
+        Daily sweep of the loans still out past their due date.
+            Calculates the fine accrued so far on each overdue loan and sends reminders to the borrowers
+            in batches, coalesced into one message per member. Fines are only added to a member's total when the
+            book is returned (see _fine_due)
+
+        :param today: int: Excel format date of the sweep. Defaults to the current date
+        :param batch_size: int: The number of notifications passed to Subject.send_emails() at a time. The sweep
+                coalesces them, so each member is sent one message when it ends whatever the batch size
+        :return: List of tuples: (LoanItem(), days overdue, fine accrued) for each overdue loan
+        """
+
+        if today is None:
+            today = Date().as_val()
+
+        with self.notify.coalesce():  # One reminder per member however many of their books are overdue
+            assessed = []
+            batch = []
+            for loan_item in self.loans.overdue(today):
+                days_over_due = today - loan_item.start_date.as_val() - self.loans.MAX_DURATION
+                fine = days_over_due * self.DAILY_FINE
+                assessed.append((loan_item, days_over_due, fine))
+
+                # Historical loans may refer to books or members no longer held. The fine is still reported
+                if (loan_item.member_uid not in self.membership.collection
+                        or loan_item.book_uid not in self.library.collection):
+                    continue
+                member = self.membership.search(loan_item.member_uid)
+                book = self.library.search(loan_item.book_uid)
+                batch.append(OverdueNotification(member, book, days_over_due, fine))
+                if len(batch) >= batch_size:
+                    self.notify.send_emails('Loans', *batch)
+                    batch = []
+
+            if batch:
+                self.notify.send_emails('Loans', *batch)
+        return assessed
 
     def checkout_books(self, member_of_public, *presented_books):
         """
@@ -189,6 +236,39 @@ class LoansInterface:
         :raises TypeError: If incorrect instance type are passed
         """
 
+        with transaction(self.library, self.membership, self.loans, self.lib_reservations):
+            self._checkout(member_of_public, *presented_books)
+            self.loans.save()
+            self.membership.save()
+            self.library.save()
+
+    def bulk_checkout(self, *requests):
+        """
+        Checks out books for a group of members, such as a school class, and saves the data to file once.
+            Each member's books are checked out exactly as checkout_books() would
+
+        :param requests: tuples of (Member() instance, list of BookItem() instances)
+        :raises TypeError: If incorrect instance type are passed
+        """
+
+        with transaction(self.library, self.membership, self.loans, self.lib_reservations):
+            for member_of_public, presented_books in requests:
+                self._checkout(member_of_public, *presented_books)
+            self.loans.save()
+            self.membership.save()
+            self.library.save()
+
+    def _checkout(self, member_of_public, *presented_books):
+        """
+        Checks out the presented books to a member without saving. See checkout_books()
+
+        :param member_of_public: a Member() instance.
+        :param presented_books: a BookItem() instance or list of BookItem() instances
+        :raises TypeError: If incorrect instance type are passed
+        """
+
+        from Membership import Member
+
         if isinstance(member_of_public, Member):
             # retrieves member instance after scanning their card
             member = self.membership.search(member_of_public.scan())
@@ -217,6 +297,8 @@ class LoansInterface:
                         self.loans.start_loan(book.uid, member.uid)
                         member.inc_loans()
                         book.set_on_loan()
+                        self.library.touch(book.uid)
+                        self.membership.touch(member.uid)
                         print(f'{book.title}: is {book.status}', end='')
                         print(f' to {member.first_name} {member.last_name}')
 
@@ -235,6 +317,8 @@ class LoansInterface:
                             self.loans.start_loan(book.uid, member.uid)
                             member.inc_loans()
                             book.set_on_loan()
+                            self.library.touch(book.uid)
+                            self.membership.touch(member.uid)
                             # Remove person from front of reservation queue
                             self.lib_reservations.cancel_res(book.uid, member.uid)
                             # Add the member to the Loans Observers
@@ -252,45 +336,108 @@ class LoansInterface:
 
                 else:
                     break  # Max loans reached. Stop checking out books
-        self.loans.save()
-        self.membership.save()
-        self.library.save()
 
     def return_books(self, *presented_books):
         """
         Scans the presented books and obtains the uid
             Sets loan return_date to current date.
             If a book is overdue then adds a fine to the library member at the daily rate
-            saves the data to file
+            saves the data to file. A member returning several books is sent one digest of their notices
         :param presented_books: str: A list of book ids to be returned
         :return:
         """
 
-        for item in presented_books:
-            if not isinstance(item, BookItem):
-                print('Invalid Class: Expecting presented book of type'
-                      'BookItem() returns')
-                continue
-            # Retrieves book and member instances
+        from Library import BookItem
 
-            book = self.library.search(item.scan())
+        with transaction(self.library, self.membership, self.loans, self.lib_reservations), \
+                self.notify.coalesce():
+            for item in presented_books:
+                if not isinstance(item, BookItem):
+                    print('Invalid Class: Expecting presented book of type'
+                          'BookItem() returns')
+                    continue
+                # Retrieves book and member instances
 
-            member = self.membership.search(self.loans.on_loan_to(book.uid))
-            # Returns book and tests to see if it's overdue
+                book = self.library.search(item.scan())
 
-            if self.loans.return_book(book.uid, member.uid) > self.loans.MAX_DURATION:
-                self._fine_due(book, member)
-            member.dec_loans()
+                member = self.membership.search(self.loans.on_loan_to(book.uid))
+                self._return(book, member)
 
-            # Deregister Subscriber from loans event if they currently have no books
-            if member.loans == 0:
-                self.notify.deregister('Loans', member.uid)
-            # Update books status is: Available or Reserved
-            self.lib_reservations.status_update(book)
+            self.loans.save()
+            self.membership.save()
+            self.library.save()
 
-        self.loans.save()
-        self.membership.save()
-        self.library.save()
+    def return_book_drop(self, *presented_books):
+        """
+        Processes a batch of returned books, such as the overnight book-drop.
+            The borrowers are resolved together from the loans index, returns and fines are applied,
+            then the fine and reservation notifications are sent as two batches and the data saved once.
+
+        :param presented_books: BookItem() instances to be returned
+        :return: int: The number of books returned
+        """
+
+        from Library import BookItem
+
+        with transaction(self.library, self.membership, self.loans, self.lib_reservations), \
+                self.notify.coalesce():
+            books = []
+            for item in presented_books:
+                if not isinstance(item, BookItem):
+                    print('Invalid Class: Expecting presented book of type'
+                          'BookItem() returns')
+                    continue
+                books.append(self.library.search(item.scan()))
+
+            holders = self.loans.holders(*(book.uid for book in books))
+            fines = []
+            reservations = []
+            released = set()
+            returned = 0
+            for book in books:
+                if book.uid not in holders:
+                    print(f'{book.title}: is not on loan')
+                    continue
+                self._return(book, self.membership.search(holders.pop(book.uid)), fines, reservations, released)
+                returned += 1
+
+            self.notify.send_emails('Loans', *fines)
+            self.notify.send_emails('Reservations', *reservations)
+            # Unsubscribed only now, so a fine for a member's last loan is still sent
+            for member_uid in released:
+                self.notify.deregister('Loans', member_uid)
+            self.loans.save()
+            self.membership.save()
+            self.library.save()
+            return returned
+
+    def _return(self, book, member, fines=None, reservations=None, released=None):
+        """
+        Returns a book on loan to member without saving. See return_books()
+
+        :param book: BookItem() instance
+        :param member: Member() instance currently loaning the book
+        :param fines: list: Optional. FineNotifications are appended to fines instead of being sent
+        :param reservations: list: Optional. ResNotifications are appended instead of being sent
+        :param released: set: Optional. The uid of a member left with no open loans is added instead of the member
+                being unsubscribed from 'Loans'. Pass it with fines and unsubscribe once they have been sent
+        """
+
+        # Returns book and tests to see if it's overdue
+        if self.loans.return_book(book.uid, member.uid) > self.loans.MAX_DURATION:
+            self._fine_due(book, member, fines)
+        member.dec_loans()
+
+        # Deregister Subscriber from loans event once they have no open loans, counted from the loans themselves
+        if self.loans.open_loans(member.uid) == 0:
+            if released is None:
+                self.notify.deregister('Loans', member.uid)
+            else:
+                released.add(member.uid)
+        # Update books status is: Available or Reserved
+        self.lib_reservations.status_update(book, reservations)
+        self.library.touch(book.uid)
+        self.membership.touch(member.uid)
 
 
 class ReservationInterface:
@@ -316,21 +463,23 @@ class ReservationInterface:
         :param member_of_public: Member() instance
         :param book_uid: int as str:
         """
-        member = self.membership.search(member_of_public.scan())
-        book = self.library.search(book_uid)
-        self.reservations.make_reservation(book.uid, member.uid)
-        res_item = self.reservations.get_reservation(book.uid, member.uid)
-        queue_pos = self.reservations.queue_pos(book.uid, member.uid)
-        print('\n', '-' * 70)
-        print(f'\nThe book: {book.title} is currently: {book.status}.\n')
-        print(f'Reservation made by: {member.first_name} '
-              f'{member.last_name} on {res_item.date_made.as_date()}\n'
-              f'Currently in queue position: {queue_pos + 1}\n')
-        if not book.is_available() or queue_pos > 0:
-            print('You will be contacted when it becomes available')
-        else:
-            print('The book is available now')
-        if not book.is_on_loan():
-            book.set_reserved()
-        # Stores reservation to JSON file
-        self.reservations.save()
+        with transaction(self.library, self.reservations):
+            member = self.membership.search(member_of_public.scan())
+            book = self.library.search(book_uid)
+            self.reservations.make_reservation(book.uid, member.uid)
+            res_item = self.reservations.get_reservation(book.uid, member.uid)
+            queue_pos = self.reservations.queue_pos(book.uid, member.uid)
+            print('\n', '-' * 70)
+            print(f'\nThe book: {book.title} is currently: {book.status}.\n')
+            print(f'Reservation made by: {member.first_name} '
+                  f'{member.last_name} on {res_item.date_made.as_date()}\n'
+                  f'Currently in queue position: {queue_pos + 1}\n')
+            if not book.is_available() or queue_pos > 0:
+                print('You will be contacted when it becomes available')
+            else:
+                print('The book is available now')
+            if not book.is_on_loan():
+                book.set_reserved()
+                self.library.touch(book.uid)
+            # Stores reservation to JSON file
+            self.reservations.save()
@@ -1,6 +1,8 @@
 """Classes to enable JSON read and write functionality """
 
 import json
+import os
+import re
 from abc import ABC, abstractmethod
 
 
@@ -16,30 +18,181 @@ class CustomDecode(json.JSONDecoder):
 
     @staticmethod
     def dict_to_obj(dct):
+        obj = dct
+        if 'class' in dct:
+            create = _CREATORS.get(dct['class']) or _creators().get(dct['class'])
+            if create is not None:
+                obj = create(dct)
+        return obj
+
+
+# Maps each 'class' tag to the create method for the object. Filled on first use so that importing JsonIO
+# does not import the modules of every stored class
+_CREATORS = {}
+
+
+def _creators():
+    """ Imports the stored classes and fills _CREATORS
+    :returns dict: _CREATORS"""
+    if not _CREATORS:
         from Library import BookItem
         from Loans import LoanItem
         from Membership import Member
         from Reservations import ReservationItem
-        obj = dct
-        if 'class' in dct.keys():
-            if dct['class'] == '__BookItem__':
-                obj = BookItem.create(dct)
+        _CREATORS.update({'__BookItem__': BookItem.create,
+                          '__Member__': Member.create,
+                          '__LoanItem__': LoanItem.create,
+                          '__ReservationItem__': ReservationItem.create})
+    return _CREATORS
 
-            if dct['class'] == '__Member__':
-                obj = Member.create(dct)
 
-            if dct['class'] == '__LoanItem__':
-                obj = LoanItem.create(dct)
+# File suffix for each compression setting
+SUFFIXES = {None: '.json', 'gzip': '.json.gz', 'zstd': '.json.zst'}
+GZIP_LEVEL = 6  # Favours save speed over the last few per cent of compression
+READ_SIZE = 64 * 1024  # Characters read at a time by iter_items()
+
+
+def json_filename(file, compression=None):
+    """ :param file: str: the file name without a suffix
+        :param compression: None, 'gzip' or 'zstd'
+    returns: str: The file name with the suffix for the compression"""
+
+    if compression not in SUFFIXES:
+        raise ValueError(f'Unknown compression: {compression}')
+    return file + SUFFIXES[compression]
+
+
+def open_json(filename, mode, compression=None):
+    """ Opens a JSON file as text, compressing or decompressing it as it is written or read.
+        gzip is in the standard library. zstd uses the standard library's compression.zstd where available
+        (Python 3.14), otherwise the optional zstandard package
+        :param filename: str: The file name including its suffix
+        :param mode: str: 'r' or 'w'
+        :param compression: None, 'gzip' or 'zstd'
+        :raises ImportError: If zstd is asked for and neither module is available
+    returns: A text file object"""
+
+    if compression is None:
+        return open(filename, mode=mode, encoding='utf-8-sig')
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(filename, mode=mode + 't', encoding='utf-8-sig', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        try:
+            from compression import zstd
+        except ImportError:
+            try:
+                import zstandard as zstd
+            except ImportError:
+                raise ImportError('zstd compression needs Python 3.14 or the zstandard package') from None
+        return zstd.open(filename, mode=mode + 't', encoding='utf-8-sig')
+    raise ValueError(f'Unknown compression: {compression}')
+
+
+def write_items(file, items):
+    """ Writes (key, value) pairs to an open file as a JSON object, one value at a time, so the whole object is
+        never held in memory. The output is the same as json.dump() of the equivalent dictionary
+        :param file: A text file object
+        :param items: iterable of (str, JSON compatible value) pairs"""
+
+    file.write('{')
+    separator = ''
+    for key, value in items:
+        file.write(f'{separator}{json.dumps(key)}: {json.dumps(value)}')
+        separator = ', '
+    file.write('}')
 
-            if dct['class'] == '__ReservationItem__':
-                obj = ReservationItem.create(dct)
-        return obj
+
+_WHITE_SPACE = re.compile(r'[ \t\n\r]*')
+# Optional comma, a key and its colon, with the white space around them
+_KEY = re.compile(r'[ \t\n\r]*(,?)[ \t\n\r]*"([^"\\]*(?:\\.[^"\\]*)*)"[ \t\n\r]*:')
+
+
+def iter_items(file, text='', object_hook=None):
+    """ Reads a JSON object from an open file one (key, value) pair at a time, so the file's text and the decoded
+        tree are never held in memory whole. Each value is decoded, and its objects created, as soon as its text
+        has been read
+        :param file: A text file object, positioned after text
+        :param text: str: Text already read from the start of the file
+        :param object_hook: Passed to the JSON decoder, e.g. CustomDecode.dict_to_obj
+        :raises json.JSONDecodeError: If the file is not a JSON object
+    returns: generator of (str, value) pairs in file order"""
+
+    scan = json.JSONDecoder(object_hook=object_hook).scan_once
+    buffer, pos, eof = text, 0, False
+
+    def fill(size=READ_SIZE):
+        """ Reads more of the file, unless at its end, so at least size characters follow pos.
+            The text before pos has been decoded and is dropped"""
+        nonlocal buffer, pos, eof
+        if not eof and len(buffer) - pos < size:
+            more = file.read(max(size, READ_SIZE))
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+
+    fill()
+    pos = _WHITE_SPACE.match(buffer, pos).end()
+    if buffer[pos:pos + 1] != '{':
+        raise json.JSONDecodeError('Expecting a JSON object', buffer, pos)
+    pos += 1
+    first = True
+    while True:
+        size = READ_SIZE
+        fill(size)
+        match = _KEY.match(buffer, pos)
+        while match is None and not eof:  # The text read so far may end inside the key
+            size *= 2
+            fill(len(buffer) - pos + size)
+            match = _KEY.match(buffer, pos)
+        if match is None:
+            pos = _WHITE_SPACE.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == '}':
+                return
+            raise json.JSONDecodeError('Expecting property name enclosed in double quotes', buffer, pos)
+        if bool(match.group(1)) == first:
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        first = False
+        key = match.group(2)
+        if '\\' in key:
+            key = json.loads(f'"{key}"')
+        pos = match.end()
+
+        # The end of the text read so far may fall inside the value, so it is decoded again with more text
+        # unless it is followed by a delimiter. A number such as 1.5 cut short at '1.' would otherwise decode as 1
+        size = READ_SIZE
+        while True:
+            pos = _WHITE_SPACE.match(buffer, pos).end()
+            try:
+                value, end = scan(buffer, pos)
+                if eof or (end < len(buffer) and buffer[end] in ' \t\n\r,}'):
+                    break
+            except (StopIteration, json.JSONDecodeError):
+                if eof:
+                    raise json.JSONDecodeError('Expecting value', buffer, pos) from None
+            size *= 2  # So a large value is decoded again a logarithmic number of times
+            fill(len(buffer) - pos + size)
+        pos = end
+        yield key, value
+
+
+def load_json(file, object_hook=None):
+    """ Reads a JSON file. A top level object is read incrementally by iter_items(). Any other value, such as the
+        list saved by MembersInterface, is read with json.load()
+        :param file: A text file object
+        :param object_hook: Passed to the JSON decoder, e.g. CustomDecode.dict_to_obj
+    returns: The data in the file"""
+
+    text = file.read(READ_SIZE)
+    if text.lstrip()[:1] != '{':
+        return json.loads(text + file.read(), object_hook=object_hook)
+    return dict(iter_items(file, text, object_hook))
 
 
 class _JsonIO(ABC):
     """ A Mixin class which provides methods to read and write objects to a file
         in json format """
     filename = ''
+    compression = None  # None, 'gzip' or 'zstd'. See set_compression()
 
     @abstractmethod
     def _make_json_dict(self):
@@ -47,17 +200,43 @@ class _JsonIO(ABC):
         The method is overloaded by child classes as necessary """
         return {}
 
+    def _json_items(self):
+        """ Overloaded by child classes whose JSON data is a dictionary, to yield its (key, value) pairs one at a
+        time so save_to_file() can write them as they are made.
+        :returns: None, meaning the data is written from _make_json_dict() in one go"""
+        return None
+
+    def set_compression(self, compression):
+        """ Sets the compression used by save_to_file() and restore(). The file suffix changes with it
+            :param compression: None, 'gzip' or 'zstd'"""
+
+        json_filename('', compression)  # Raises ValueError for an unknown compression
+        self.compression = compression
+
     def save_to_file(self, file):
-        """ Saves the list of dict returned from a class' _make_json_dict method to self._filename in json format.
+        """ Saves the data from a class' _json_items or _make_json_dict method to self._filename in json format.
+            Items are encoded and written one at a time, compressed as they are written if a compression is set.
+            They are written to a temporary file that then replaces the file, so a reader in another process never
+            sees a partly written file
             :param file: str: the file name to save to without a suffix
             :raises Exception: If the file can not be written """
 
+        filename = json_filename(file, self.compression)
+        temporary = f'{filename}.{os.getpid()}.tmp'  # One per process, as processes outside a lock may save at once
         try:
-            with open(file + '.json', mode='w',
-                      encoding='utf-8-sig') as JsonFile:
-                json.dump(self._make_json_dict(), JsonFile)
+            with open_json(temporary, 'w', self.compression) as JsonFile:
+                items = self._json_items()
+                if items is None:
+                    json.dump(self._make_json_dict(), JsonFile)
+                else:
+                    write_items(JsonFile, items)
+            os.replace(temporary, filename)
 
+        except ImportError:
+            raise
         except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
             raise Exception(f'Unable to write to file {file}')
 
     def restore(self, file):
@@ -68,12 +247,24 @@ class _JsonIO(ABC):
         JsonFileObj
             If file is empty or does not exist, an exception is raised"""
 
-        try:
-            with open(file + '.json', 'r',
-                      encoding='utf-8-sig') as JsonFile:
-                JsonFileObj = json.load(JsonFile, object_hook=CustomDecode().dict_to_obj)
-                return JsonFileObj
-        except FileNotFoundError:
-            raise FileNotFoundError(f'Unable to find {file}.json')
-        except Exception:
-            raise Exception('Unable to restore from file {file}')
+        return read_json(file, self.compression)
+
+
+def read_json(file, compression=None):
+    """ Reads a JSON file written by _JsonIO.save_to_file. Module level so DeltaJsonStorage can read its snapshots
+        without a store. The records of a store are decoded one at a time as the file is read, see load_json()
+        :param file: str: the file name without a suffix
+        :param compression: None, 'gzip' or 'zstd'
+        :raises Exception: If the data can not be read and restored
+        :raises FileNotFound: If the file path is incorrect or the file does not exist
+    returns: dict: data stored in the JSON file reformed into the correct object types"""
+
+    filename = json_filename(file, compression)
+    try:
+        with open_json(filename, 'r', compression) as JsonFile:
+            JsonFileObj = load_json(JsonFile, object_hook=CustomDecode.dict_to_obj)
+            return JsonFileObj
+    except FileNotFoundError:
+        raise FileNotFoundError(f'Unable to find {filename}')
+    except Exception:
+        raise Exception(f'Unable to restore from file {file}')
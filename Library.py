@@ -1,6 +1,9 @@
 """Definitions for the Library and Book Classes along with the System interfaces used by
 the Librarians to carry out their every day activities"""
 
+import sys
+
+import Changes
 from Aggregator import _Aggregator
 from CsvIO import _CsvIO
 from JsonIO import _JsonIO
@@ -109,16 +112,19 @@ class BookItem:
         """Sets the status flag to Available"""
 
         self.status = 'Available'
+        Changes.emit('status', 'BookItem', self.uid, {'status': self.status})
 
     def set_on_loan(self):
         """Sets the status flag to being on loan"""
 
         self.status = 'On loan'
+        Changes.emit('status', 'BookItem', self.uid, {'status': self.status})
 
     def set_reserved(self):
         """Sets the status flag to being reserved"""
 
         self.status = 'Reserved'
+        Changes.emit('status', 'BookItem', self.uid, {'status': self.status})
 
     @staticmethod
     def create(attributes):
@@ -126,19 +132,21 @@ class BookItem:
         to the Library() collection by the read.csv() and restore() methods.
 
         :param attributes: dict: A dictionary of attributes for a single book
-                keys = {'uid':, 'title':, 'author':, 'genre':,'subgenre':,'publisher':}
+                keys = {'uid':, 'title':, 'author':, 'genre':,'subgenre':,'publisher':, 'status':}
         :returns a BookItem instance
                 If any key is missing empty string assigned as default value
         :raises Exception: If attributes is not a dictionary"""
 
         if isinstance(attributes, dict):
-            uid = attributes.get('uid', '')
+            uid = sys.intern(attributes.get('uid', ''))  # Shared with the uids in Loans keys
             title = attributes.get('title', '')
             author = attributes.get('author', '')
             genre = attributes.get('genre', '')
-            sub_genre = attributes.get('subgenre', '')
+            # csv files name the column 'subgenre', JSON files written by as_json_dict() 'sub_genre'
+            sub_genre = attributes.get('subgenre', attributes.get('sub_genre', ''))
             publisher = attributes.get('publisher', '')
-            return BookItem(uid, title, author, genre, sub_genre, publisher)
+            status = attributes.get('status', 'Available')
+            return BookItem(uid, title, author, genre, sub_genre, publisher, status)
         else:
             raise Exception('Argument should be dictionary of attributes')
 
@@ -2,7 +2,15 @@
 Classes that provide methods to create and maintain loans between Member() and BookItem() instances
 """
 
-from Aggregator import _Aggregator
+import glob
+import json
+import os
+import sys
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+
+import Changes
+from Aggregator import _Aggregator, _LazyCollection
 from CsvIO import _CsvIO
 from JsonIO import _JsonIO
 from Singleton import _Singleton
@@ -69,8 +77,10 @@ class LoanItem:
         """
 
         if isinstance(attributes, dict):  # Guardian check for correct type
-            book_uid = attributes.get('book_uid', '')
-            member_uid = attributes.get('member_uid', '')
+            # Interned so that the uids of every loan of a book or member share one string, which the tuple
+            # keys of Loans.collection hash and compare cheaply
+            book_uid = sys.intern(attributes.get('book_uid', ''))
+            member_uid = sys.intern(attributes.get('member_uid', ''))
             start_date = (int(attributes.get('start_date', '')))
             return_date = (int(attributes.get('return_date', '')))
             return LoanItem(book_uid, member_uid, start_date, return_date)
@@ -92,21 +102,46 @@ class Loans(_Aggregator, _JsonIO, _CsvIO,  _Singleton):
         Inherits Singleton properties.
         Aggregates LoanItem  Objects.
         Loans are stored in self.collection{}.
-            The Keys = 'book_uid-member_uid'
+            The Keys = (book_uid, member_uid) tuples. Saved files, storage backends and the change stream use the
+                string form 'book_uid-member_uid'
             Key values = list of LoanItem objects. The Current loan is the last item in the list
         _filename holds name of file for save / restore methods as a string
+        _due_index holds (start_date, key) tuples for open loans in start date order. Entries for loans that have
+            since been returned are removed lazily by overdue()
+        _on_loan maps the book_uid of each open loan to the member_uid of the borrower
+        _open_count maps the member_uid of each borrower to their number of open loans
+        Closed loans older than ARCHIVE_AGE days can be moved by archive() to append only segment files, one per
+            month of return date: '<_filename>.archive.<yyyy-mm>.jsonl'. history() reads them with the store
         """
 
     _filename = 'loans'  # Sets default file name
-    collection = {}
+    _collection = {}  # See the collection property
+    _due_index = []  # Sorted list of (start_date, key) for open loans
+    _on_loan = {}  # book_uid -> member_uid for open loans
+    _open_count = {}  # member_uid -> number of open loans
     MAX_LOANS = 5  # The maximum number of loans a member can have.
     MAX_DURATION = 14  # The maximum number of days for a loan.
+    ARCHIVE_AGE = 365  # Days after its return that archive() moves a loan out of self.collection
+
+    @property
+    def collection(self):
+        """ dict: The loans. Setting it rebuilds _due_index, _on_loan and _open_count, so the indexes describe the
+            collection however it was replaced. The stand in set by restore_on_demand() is indexed once it loads """
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        if isinstance(collection, _LazyCollection):
+            self._due_index, self._on_loan, self._open_count = [], {}, {}
+        else:
+            self._reindex()
 
     def __str__(self):
         """ Unpacks self.collection for string calls """
         dct = {}
         for key in self.collection:
-            dct[key] = [obj.as_dict() for obj in self.collection[key]]
+            dct['-'.join(key)] = [obj.as_dict() for obj in self.collection[key]]
         return str(dct)
 
     def read_csv(self, filename, **kwargs):
@@ -123,25 +158,76 @@ class Loans(_Aggregator, _JsonIO, _CsvIO,  _Singleton):
             The current loan is appended to the end of the list
             loan_item must be an instance of LoanItem() """
         if isinstance(loan_item, LoanItem):
-            key = loan_item.book_uid + '-' + loan_item.member_uid
+            key = (loan_item.book_uid, loan_item.member_uid)
+            # An open loan replaced as the current loan of its key is no longer counted
+            replaced = key in self.collection and int(self.collection[key][-1].return_date.date) == 0
             if key in self.collection:
                 self.collection[key].append(loan_item)
             else:
                 self.collection[key] = [loan_item]
+                self._index_key(key)
+            self.touch(key)
+            if int(loan_item.return_date.date) == 0:
+                insort(self._due_index, (loan_item.start_date.as_val(), key))
+                self._on_loan[loan_item.book_uid] = loan_item.member_uid
+                if not replaced:
+                    self._count_open(loan_item.member_uid, 1)
+                Changes.emit('loan_open', 'LoanItem', key, loan_item)
+            else:
+                if replaced:
+                    self._count_open(loan_item.member_uid, -1)
+                Changes.emit('insert', 'LoanItem', key, loan_item)
         else:
             raise TypeError(f'Loans(): {loan_item} Must be a LoanItem() object')
         return
 
+    def _decode_keys(self, collection):
+        """ Replaces the 'book_uid-member_uid' keys of a restored collection with (book_uid, member_uid) tuples.
+            The tuples are built from the loans' own interned uids rather than by splitting the strings"""
+        return {(loans[-1].book_uid, loans[-1].member_uid): loans for loans in collection.values()}
+
+    def _encode_keys(self, collection, keys):
+        """ Presents self.collection and changed keys to a storage backend with 'book_uid-member_uid' keys """
+        return _StringKeys(collection), None if keys is None else {'-'.join(key) for key in keys}
+
+    def sync(self):
+        """ Takes in changes saved by other processes then rebuilds the indexes. See _Aggregator.sync() """
+        if super().sync():
+            self._reindex()
+            return True
+        return False
+
+    def _reindex(self):
+        """ Rebuilds self._due_index, self._on_loan and self._open_count from the current loan of every key in
+            self.collection """
+        open_loans = [(key, loans[-1]) for key, loans in self.collection.items()
+                      if int(loans[-1].return_date.date) == 0]
+        self._due_index = sorted((loan_item.start_date.as_val(), key) for key, loan_item in open_loans)
+        self._on_loan = {loan_item.book_uid: loan_item.member_uid for key, loan_item in open_loans}
+        self._open_count = {}
+        for key, loan_item in open_loans:
+            self._count_open(loan_item.member_uid, 1)
+
+    def _count_open(self, member_uid, change):
+        """ Adds change to a member's number of open loans, removing members left with none """
+        count = self._open_count.get(member_uid, 0) + change
+        if count > 0:
+            self._open_count[member_uid] = count
+        else:
+            self._open_count.pop(member_uid, None)
+
     def _make_json_dict(self):
         """:returns: self.collection unpacked as a json compatible dictionary"""
-        dct = {}
+        return dict(self._json_items())
+
+    def _json_items(self):
+        """ Yields each 'book_uid-member_uid' key with its list of loans as dictionaries, one key at a time """
         for key in self.collection:
-            dct[key] = [obj.as_json_dict() for obj in self.collection[key]]
-        return dct
+            yield '-'.join(key), [obj.as_json_dict() for obj in self.collection[key]]
 
     def search(self, book_uid, member_uid):
         """:returns: The list of LoanItems with the compound key"""
-        return super().search(book_uid + '-' + member_uid)
+        return super().search((book_uid, member_uid))
 
     def start_loan(self, book_uid, member_uid):
         """ Starts a new loan using the default date values.
@@ -157,6 +243,11 @@ class Loans(_Aggregator, _JsonIO, _CsvIO,  _Singleton):
         loan_item = self.search(book_uid, member_uid)[-1]
         if int(loan_item.return_date.date) == 0:
             loan_item.return_date = Date()
+            self.touch((book_uid, member_uid))
+            Changes.emit('loan_close', 'LoanItem', (book_uid, member_uid), loan_item)
+            if self._on_loan.get(book_uid) == member_uid:
+                del self._on_loan[book_uid]
+            self._count_open(member_uid, -1)
         else:
             raise Exception('Loans(): Err with return date for item with key:'
                             f' {book_uid}-{member_uid}')
@@ -173,9 +264,9 @@ class Loans(_Aggregator, _JsonIO, _CsvIO,  _Singleton):
         current_loans = []
 
         for key in self.collection:
-            # Slices out the right side of the hyphen to get member_uid part only of the compound key
+            # Compares the member_uid part of the compound key
             # Looks for books with the return_date set to 0 i.e. still on loan
-            if key[key.find('-') + 1:] == member_uid:
+            if key[1] == member_uid:
                 if int(self.collection[key][-1].return_date.date) == 0:
                     current_loans.append(self.collection[key][-1])
         return current_loans
@@ -189,11 +280,207 @@ class Loans(_Aggregator, _JsonIO, _CsvIO,  _Singleton):
                 or None if the book is not loaned
         """
 
-        for key in self.collection:
-            # Slices out the left side of the hyphen to get book_uid part only of the compound key
-            if key[:key.find('-')] == book_uid:
-                # Returns uid if book still on loan
-                if int(self.collection[key][-1].return_date.date) == 0:
-                    return self.collection[key][-1].member_uid
+        self._ensure_loaded()
+        return self._on_loan.get(book_uid)
+
+    def holders(self, *book_uids):
+        """
+        Finds the members currently loaning several books in one pass
+
+        :param book_uids: int as str: The books to look up
+        :return: dict: book_uid -> member_uid for each of the books that is on loan
+        """
+
+        self._ensure_loaded()
+        return {book_uid: self._on_loan[book_uid] for book_uid in book_uids if book_uid in self._on_loan}
+
+    def open_loans(self, member_uid):
+        """
+        Counts a member's open loans from the loans themselves, rather than from Member().no_of_loans, which
+            starts at '0' for members read from a csv file whatever their loans
+
+        :param member_uid: int as str
+        :return: int: The number of loans the member has not returned
+        """
+
+        self._ensure_loaded()
+        return self._open_count.get(member_uid, 0)
 
-        return None
+    def borrowers(self):
+        """:return: set: The uids of the members with at least one book on loan"""
+
+        self._ensure_loaded()
+        return set(self._open_count)
+
+    def overdue(self, today=None):
+        """
+        Finds the open loans that have been out for longer than MAX_DURATION days.
+            Only the front of the due date index is visited. Entries for loans returned since they were indexed
+            are dropped as they are found, so the cost is proportional to the number of overdue loans.
+
+        :param today: int: Excel format date to test against. Defaults to the current date
+        :return: List of LoanItem(): The overdue loans, oldest first
+        """
+
+        if today is None:
+            today = Date().as_val()
+        self._ensure_loaded()
+        # Loans that started before the cutoff date are overdue
+        end = bisect_left(self._due_index, (today - self.MAX_DURATION,))
+
+        overdue_loans = []
+        live = []
+        seen = set()
+        for start_date, key in self._due_index[:end]:
+            loan_item = self.collection[key][-1] if key in self.collection else None
+            if (loan_item is not None and key not in seen and int(loan_item.return_date.date) == 0
+                    and loan_item.start_date.as_val() == start_date):
+                seen.add(key)
+                live.append((start_date, key))
+                overdue_loans.append(loan_item)
+        self._due_index[:end] = live  # Drops the stale entries
+        return overdue_loans
+
+    def archive(self, age=None, today=None):
+        """
+        Moves the loans returned more than age days ago out of self.collection into the archive segments, then
+            saves the store. Open loans and recent loans stay, so the current loan is still the last in its list.
+            Each segment is appended to and flushed to disk before the store is saved. Should the save not happen,
+            history() skips the copies of loans left in both, and the next archive() does not append them again
+
+        :param age: int: Days since return. Defaults to ARCHIVE_AGE
+        :param today: int: Excel format date to count from. Defaults to the current date
+        :return: int: The number of loans archived
+        """
+
+        if today is None:
+            today = Date().as_val()
+        cutoff = today - (self.ARCHIVE_AGE if age is None else age)
+        segments = {}
+        keys = []
+        for key, loan_items in self.collection.items():
+            count = 0
+            # The loans of a key are in date order, so those to archive are at the front of the list
+            for loan_item in loan_items:
+                if not 0 < loan_item.return_date.as_val() < cutoff:
+                    break
+                count += 1
+            if count:
+                keys.append((key, count))
+                for loan_item in loan_items[:count]:
+                    segments.setdefault(self._segment_name(loan_item), []).append(loan_item)
+
+        for month, loan_items in segments.items():
+            # Loans left in the store by an archive that did not get as far as saving are already in the segment
+            written = self._segment_ids(month)
+            loan_items = [loan_item for loan_item in loan_items if _loan_id(loan_item) not in written]
+            with open(self._segment_file(month), mode='a', encoding='utf-8') as file:
+                file.writelines(json.dumps(loan_item.as_json_dict()) + '\n' for loan_item in loan_items)
+                file.flush()
+                os.fsync(file.fileno())
+        for key, count in keys:
+            if count == len(self.collection[key]):
+                del self.collection[key]
+                self._unindex_key(key)
+            else:
+                del self.collection[key][:count]
+            self.touch(key)
+        if keys:
+            self.save()
+        return sum(count for _, count in keys)
+
+    @staticmethod
+    def _segment_name(loan_item):
+        """:returns str: 'yyyy-mm' of the loan's return date, naming the archive segment it belongs in"""
+        _, month, year = loan_item.return_date.as_date().split('/')
+        return f'{year}-{month}'
+
+    def _segment_file(self, month):
+        """:returns str: The file name of the archive segment for month"""
+        return f'{self._filename}.archive.{month}.jsonl'
+
+    def _segment_ids(self, month):
+        """:returns set: The (book_uid, member_uid, start_date) of each loan in a month's archive segment"""
+        if not os.path.exists(self._segment_file(month)):
+            return set()
+        with open(self._segment_file(month), encoding='utf-8') as file:
+            return {_loan_id(LoanItem.create(json.loads(line))) for line in file}
+
+    def archive_segments(self):
+        """:returns list: The 'yyyy-mm' names of the archive segments, oldest first"""
+        start = len(self._filename) + len('.archive.')
+        names = glob.glob(glob.escape(self._filename) + '.archive.*.jsonl')
+        return sorted(name[start:-len('.jsonl')] for name in names)
+
+    def history(self, book_uid=None, member_uid=None, since=None):
+        """
+        Finds loans in the archive segments and in self.collection, oldest segment first
+
+        :param book_uid: int as str: Optional. Only loans of this book
+        :param member_uid: int as str: Optional. Only loans to this member
+        :param since: int: Optional Excel format date. Only loans open on or after it. Segments of months before
+                it are not read
+        :return: generator of LoanItem()
+        """
+
+        first = None
+        if since is not None:
+            _, month, year = Date(since).as_date().split('/')
+            first = f'{year}-{month}'
+
+        def wanted(loan_item):
+            return ((book_uid is None or loan_item.book_uid == book_uid)
+                    and (member_uid is None or loan_item.member_uid == member_uid)
+                    and (since is None or not 0 < loan_item.return_date.as_val() < since))
+
+        if book_uid is not None and member_uid is not None:
+            loan_lists = [self.collection.get((book_uid, member_uid), [])]
+        else:
+            loan_lists = self.collection.values()
+        # Loans still in the store may also be in a segment, should an archive() not have saved the store
+        in_store = {_loan_id(loan_item) for loan_items in loan_lists for loan_item in loan_items
+                    if wanted(loan_item)}
+
+        for month in self.archive_segments():
+            if first is not None and month < first:
+                continue
+            seen = set()  # A copy of a loan is always in the segment of its return month
+            with open(self._segment_file(month), encoding='utf-8') as file:
+                for line in file:
+                    loan_item = LoanItem.create(json.loads(line))
+                    if wanted(loan_item):
+                        loan_id = _loan_id(loan_item)
+                        if loan_id not in seen and loan_id not in in_store:
+                            seen.add(loan_id)
+                            yield loan_item
+
+        for loan_items in loan_lists:
+            for loan_item in loan_items:
+                if wanted(loan_item):
+                    yield loan_item
+
+
+def _loan_id(loan_item):
+    """:returns tuple: (book_uid, member_uid, start_date), which tells a loan apart from others"""
+    return loan_item.book_uid, loan_item.member_uid, loan_item.start_date.date
+
+
+class _StringKeys(Mapping):
+    """ Read only view of a Loans collection with the keys in their 'book_uid-member_uid' string form """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getitem__(self, key):
+        book_uid, _, member_uid = key.partition('-')
+        return self._collection[(book_uid, member_uid)]
+
+    def __contains__(self, key):
+        book_uid, _, member_uid = key.partition('-')
+        return (book_uid, member_uid) in self._collection
+
+    def __iter__(self):
+        return ('-'.join(key) for key in self._collection)
+
+    def __len__(self):
+        return len(self._collection)
@@ -2,6 +2,9 @@
 Classes that provide methods to create and maintain the library membership
 """
 
+import sys
+
+import Changes
 from Aggregator import _Aggregator
 from Observer import Observer
 from CsvIO import _CsvIO
@@ -63,20 +66,24 @@ class Member(Observer):
     def inc_loans(self):
         """ Increments the number of current loans by 1"""
         self.no_of_loans = str(int(self.no_of_loans) + 1)
+        Changes.emit('status', 'Member', self.uid, {'no_of_loans': self.no_of_loans})
 
     def dec_loans(self):
         """ Decrements the number of current loans by 1"""
         self.no_of_loans = str(int(self.no_of_loans) - 1)
+        Changes.emit('status', 'Member', self.uid, {'no_of_loans': self.no_of_loans})
 
     def add_fine(self, amount):
         """Adds a new fine to the total owed.
         :param amount: float or integer: The fine to be added"""
         self.fines = str(float(self.fines) + amount)
+        Changes.emit('fine', 'Member', self.uid, {'fines': self.fines, 'amount': amount})
 
     def sub_fine(self, amount):
         """Subtracts paid fines from the total owed.
           :param amount: float or integer"""
         self.fines = str(float(self.fines) - amount)
+        Changes.emit('fine', 'Member', self.uid, {'fines': self.fines, 'amount': -amount})
 
     def has_fine(self):
         """:returns bool: True if member has fines"""
@@ -86,20 +93,22 @@ class Member(Observer):
     def create(attributes):
         """ :returns : a Member() instance created from an attributes dictionary
                 keys = {'uid':,'first_name':, 'last_name':, 'gender':,
-                    'email':, 'card_number':}
+                    'email':, 'card_number':, 'no_of_loans':, 'fines':}
                 If any key is missing, '' assigned as default value
              :raises TypeError: If attributes is not a dict"""
 
         if isinstance(attributes, dict):
-            uid = attributes.get('uid', '')
+            uid = sys.intern(attributes.get('uid', ''))  # Shared with the uids in Loans keys
             first_name = attributes.get('first_name', '')
             last_name = attributes.get('last_name', '')
             gender = attributes.get('gender', '')
             email = attributes.get('email', '')
             card_number = attributes.get('card_number', '0')
+            no_of_loans = attributes.get('no_of_loans', '0')
+            fines = attributes.get('fines', '0.0')
 
             return Member(uid, first_name, last_name, gender, email,
-                          card_number)
+                          card_number, no_of_loans, fines)
         else:
             raise TypeError('Argument should be dictionary of attributes')
 
@@ -147,5 +156,5 @@ class Membership(_Aggregator, _CsvIO, _JsonIO, _Singleton):
         return str(last_id + 1)
 
     def all_members(self):
-        """:returns: dict: The entire membership"""
+        """:returns: dict: The entire membership. The live collection, use iter_items() to read it in order"""
         return self.collection
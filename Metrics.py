@@ -0,0 +1,223 @@
+"""
+Instrumentation for the library system's hot paths.
+Records call counts, latency histograms and the bytes written by each store's save.
+
+Metrics are off by default. enable() wraps the methods listed in TARGETS and disable() removes the wrappers, so there
+is no cost at all while instrumentation is off. Profiling may wrap the same methods, in either order.
+The timed() context manager can be used to measure any other block of code and does nothing while disabled.
+"""
+
+import importlib
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from JsonIO import json_filename
+from Singleton import _Singleton
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (module, class, method) wrapped by enable(). Calls are labelled with the class of the instance
+# that made the call, so inherited save/restore methods are recorded per store
+TARGETS = [('Aggregator', '_Aggregator', 'save'),
+           ('Aggregator', '_Aggregator', 'restore'),
+           ('Observer', 'Subject', 'save'),
+           ('Observer', 'Subject', 'restore'),
+           ('Interface', 'MembersInterface', 'add_member'),
+           ('Interface', 'MembersInterface', 'update_card'),
+           ('Interface', 'MembersInterface', 'save'),
+           ('Interface', 'MembersInterface', 'restore'),
+           ('Interface', 'LoansInterface', 'checkout_books'),
+           ('Interface', 'LoansInterface', 'return_books'),
+           ('Interface', 'LoansInterface', 'bulk_checkout'),
+           ('Interface', 'LoansInterface', 'return_book_drop'),
+           ('Interface', 'LoansInterface', 'overdue_sweep'),
+           ('Interface', 'ReservationInterface', 'make_reservation')]
+
+# Methods that write a file. The size of the file written is added to the bytes written by the instance's class
+WRITERS = [('JsonIO', '_JsonIO', 'save_to_file')]
+
+
+def unwrap(cls, name, wrapper):
+    """
+    Removes a wrapper installed on cls.name, wherever it is in the chain of wrappers. The wrappers made here and in
+        Profiling call their __wrapped__ attribute rather than the function they were made with, so the others
+        keep working and either module can be disabled first
+
+    :param cls: The class the wrapper was installed on
+    :param name: str: The method name
+    :param wrapper: The function installed by setattr()
+    """
+
+    current = cls.__dict__.get(name)
+    if current is wrapper:
+        setattr(cls, name, wrapper.__wrapped__)
+        return
+    while current is not None:
+        inner = getattr(current, '__wrapped__', None)
+        if inner is wrapper:
+            current.__wrapped__ = wrapper.__wrapped__
+            return
+        current = inner
+
+
+class _Histogram:
+    """ Latency histogram with fixed BUCKETS. counts[i] is the number of observations <= BUCKETS[i]
+        with a final bucket for anything larger """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def as_dict(self):
+        """:returns dict: count, sum and the per bucket counts keyed by upper bound"""
+        buckets = {str(bound): self.counts[i] for i, bound in enumerate(BUCKETS)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class Metrics(_Singleton):
+    """
+    Stores the recorded metrics. Inherits Singleton properties so every instrumented method reports to one place.
+
+        latency: dict: label ('Class.method') -> _Histogram of call durations in seconds
+        bytes_written: dict: Class name -> total bytes written by save_to_file
+        enabled: bool: True while the TARGETS are wrapped
+    """
+
+    latency = {}
+    bytes_written = {}
+    enabled = False
+    _wrappers = {}  # (class, method name) -> the wrapper installed
+
+    def observe(self, label, seconds):
+        """ Records one call of label taking seconds """
+        histogram = self.latency.get(label)
+        if histogram is None:
+            histogram = self.latency[label] = _Histogram()
+        histogram.observe(seconds)
+
+    def add_bytes(self, label, count):
+        """ Adds count bytes to the total written for label """
+        self.bytes_written[label] = self.bytes_written.get(label, 0) + count
+
+    @contextmanager
+    def timed(self, label):
+        """ Context manager recording the time taken by its block as a call of label while enabled
+        :param label: str: Name the timing is recorded under"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - start)
+
+    def instrument(self, label=None):
+        """ Decorator timing each call of a function while enabled
+        :param label: str: Name the timing is recorded under. Defaults to the function's qualified name"""
+
+        def decorator(func):
+            name = label or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def _timed_method(self, func):
+        """:returns: func wrapped to record its latency against the calling instance's class"""
+
+        @wraps(func)
+        def wrapper(obj, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return wrapper.__wrapped__(obj, *args, **kwargs)
+            finally:
+                self.observe(f'{type(obj).__name__}.{func.__name__}', time.perf_counter() - start)
+        return wrapper
+
+    def _sized_method(self, func):
+        """:returns: func wrapped to record the size of the file written (the first argument, without suffix)"""
+
+        @wraps(func)
+        def wrapper(obj, file, *args, **kwargs):
+            result = wrapper.__wrapped__(obj, file, *args, **kwargs)
+            try:
+                self.add_bytes(type(obj).__name__, os.path.getsize(json_filename(file, obj.compression)))
+            except OSError:
+                pass
+            return result
+        return wrapper
+
+    def enable(self):
+        """ Wraps the TARGETS and WRITERS methods so calls are recorded """
+        if self.enabled:
+            return
+        for targets, wrap in ((TARGETS, self._timed_method), (WRITERS, self._sized_method)):
+            for module, cls_name, method in targets:
+                cls = getattr(importlib.import_module(module), cls_name)
+                wrapper = self._wrappers[(cls, method)] = wrap(cls.__dict__[method])
+                setattr(cls, method, wrapper)
+        self.enabled = True
+
+    def disable(self):
+        """ Removes the wrappers, restoring the original methods. Recorded metrics are kept until reset() """
+        for (cls, method), wrapper in self._wrappers.items():
+            unwrap(cls, method, wrapper)
+        self._wrappers.clear()
+        self.enabled = False
+
+    def reset(self):
+        """ Clears all recorded metrics """
+        self.latency.clear()
+        self.bytes_written.clear()
+
+    def snapshot(self):
+        """:returns dict: The recorded metrics as a JSON compatible dictionary"""
+        return {'latency': {label: histogram.as_dict() for label, histogram in self.latency.items()},
+                'bytes_written': dict(self.bytes_written)}
+
+    def prometheus(self):
+        """:returns str: The recorded metrics in the Prometheus text exposition format"""
+        lines = ['# TYPE library_calls_total counter']
+        lines += [f'library_calls_total{{op="{label}"}} {histogram.count}'
+                  for label, histogram in self.latency.items()]
+
+        lines.append('# TYPE library_latency_seconds histogram')
+        for label, histogram in self.latency.items():
+            cumulative = 0
+            for i, bound in enumerate(BUCKETS + ('+Inf',)):
+                cumulative += histogram.counts[i]
+                lines.append(f'library_latency_seconds_bucket{{op="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'library_latency_seconds_sum{{op="{label}"}} {histogram.sum}')
+            lines.append(f'library_latency_seconds_count{{op="{label}"}} {histogram.count}')
+
+        lines.append('# TYPE library_bytes_written_total counter')
+        lines += [f'library_bytes_written_total{{store="{label}"}} {count}'
+                  for label, count in self.bytes_written.items()]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        """ Writes prometheus() to filename for a node exporter textfile collector.
+            The file is replaced atomically so a collector never reads a partial file"""
+        with open(filename + '.tmp', mode='w', encoding='utf-8') as file:
+            file.write(self.prometheus())
+        os.replace(filename + '.tmp', filename)
@@ -1,9 +1,50 @@
 """
-
+Notification classes passed to Subject.send_email().
+Messages are rendered from each class' TEMPLATE the first time they are read, so notices that are filtered out
+before delivery never build their message. A DigestNotification combines several notices for one member into a
+single message made from each notice's SUMMARY line.
 """
 
 
-class FineNotification:
+class _Notification:
+    """ Base class for notifications. Subclasses set TEMPLATE, a str.format template, and provide the values
+        for its fields with _fields() """
+
+    TEMPLATE = ''
+    SUMMARY = ''  # One line version of the message used in a DigestNotification
+    all = False  # Flag to broadcast to all
+    _message = None
+
+    def _fields(self):
+        """:returns dict: The values for the fields in TEMPLATE"""
+        return self.__dict__
+
+    @property
+    def message(self):
+        """:returns str: The rendered message. Rendered on first access"""
+        if self._message is None:
+            self._message = self.TEMPLATE.format(**self._fields())
+        return self._message
+
+    @message.setter
+    def message(self, text):
+        self._message = text
+
+    @property
+    def summary(self):
+        """:returns str: The notice as a line of a digest. The whole message if the class has no SUMMARY"""
+        if not self.SUMMARY:
+            return self.message
+        return self.SUMMARY.format(**self._fields())
+
+
+class FineNotification(_Notification):
+    TEMPLATE = ('\nEmailed to: {member.email} '
+                '\nDear {member.first_name} {member.last_name},\n'
+                'You returned the book {book.title} {days} days late.\n'
+                'There is now a fine due of: £{fine}\n')
+    SUMMARY = 'You returned the book {book.title} {days} days late. Fine due: £{fine}\n'
+
     def __init__(self, member, book, days_over_due, fine):
         """Encapsulates an overdue book message to a member"""
         self.all = False  # Flag to broadcast to all
@@ -11,23 +52,33 @@ class FineNotification:
         self.days = days_over_due
         self.book = book
         self.member = member
-        self.message = (f'\nEmailed to: {self.member.email} '
-                        f'\nDear {self.member.first_name} {self.member.last_name},\n'
-                        f'You returned the book {self.book.title} {self.days} days late.\n'
-                        f'There is now a fine due of: £{self.fine}\n')
 
 
-class ResNotification:
+class OverdueNotification(FineNotification):
+    """Encapsulates a reminder to a member for a book still on loan past its due date"""
+    TEMPLATE = ('\nEmailed to: {member.email} '
+                '\nDear {member.first_name} {member.last_name},\n'
+                'The book {book.title} is {days} days overdue.\n'
+                'A fine of £{fine} has accrued and will be due when it is returned\n')
+    SUMMARY = 'The book {book.title} is {days} days overdue. Fine accrued: £{fine}\n'
+
+
+class ResNotification(_Notification):
+    TEMPLATE = ('\nEmailed to: {member.email} '
+                '\nDear {member.first_name} {member.last_name},\n'
+                '{book.title} which you reserved on {date_made}\n'
+                'is now available for you pick up.\n')
+    SUMMARY = '{book.title} which you reserved on {date_made} is now available for you to pick up.\n'
+
     def __init__(self, member, book, res):
         """Encapsulates a reservations message to a member"""
         self.all = False  # Flag to broadcast to all
         self.res = res
         self.book = book
         self.member = member
-        self.message = (f'\nEmailed to: {self.member.email} '
-                        f'\nDear {self.member.first_name} {self.member.last_name},\n'
-                        f'{self.book.title} which you reserved on {self.res.date_made.as_date()}\n'
-                        f'is now available for you pick up.\n')
+
+    def _fields(self):
+        return {'member': self.member, 'book': self.book, 'date_made': self.res.date_made.as_date()}
 
 
 # class BookNotification:
@@ -40,12 +91,31 @@ class ResNotification:
 #                         f' is now available for you to loan.\n')
 
 
-class CardNotification:
+class CardNotification(_Notification):
+    TEMPLATE = ('\nEmailed to: {member.email}'
+                '\nDear {member.first_name},\n'
+                'Your new library card is available to be picked up \n'
+                'Card number: {member.card_number}\n')
+    SUMMARY = 'Your new library card {member.card_number} is available to be picked up.\n'
+
     def __init__(self, member):
         """Encapsulates a message to a member"""
         self.all = False
         self.member = member
-        self.message = (f'\nEmailed to: {self.member.email}'
-                        f'\nDear {self.member.first_name},\n'
-                        'Your new library card is available to be picked up \n'
-                        f'Card number: {self.member.card_number}\n')
+
+
+class DigestNotification(_Notification):
+    TEMPLATE = ('\nEmailed to: {member.email} '
+                '\nDear {member.first_name} {member.last_name},\n'
+                'You have {count} new notices:\n'
+                '{items}')
+
+    def __init__(self, member, notices):
+        """Encapsulates several notices to one member as a single message"""
+        self.all = False
+        self.member = member
+        self.notices = notices
+
+    def _fields(self):
+        return {'member': self.member, 'count': len(self.notices),
+                'items': ''.join(f' - {notice.summary}' for notice in self.notices)}
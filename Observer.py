@@ -1,7 +1,15 @@
 """
 Observer and Subject Classes to implement a notification system
 """
-from JsonIO import _JsonIO
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from Aggregator import _SharedFile
+from JsonIO import _JsonIO, json_filename
+from Notifications import DigestNotification
 
 
 class Observer:
@@ -24,7 +32,7 @@ class Observer:
             print(notice.message)
 
 
-class Subject(_JsonIO):
+class Subject(_JsonIO, _SharedFile):
     def __init__(self, membership):
         """
         The Subject class (observable) of an Observer Pattern.
@@ -37,24 +45,101 @@ class Subject(_JsonIO):
         self.events = {}
         self.filename = 'events'
         self.lib_membership = membership
+        self._storage = None  # Storage backend used in place of the JSON file
+        self._dirty = None  # Events changed since the last save. None until saved or restored
+        self.window = None  # Seconds notices are held for before being coalesced. See set_window()
+        self._coalescing = 0  # Depth of coalesce() blocks
+        self._pending = {}  # member uid -> list of notices held back for a digest
+        self._held_since = None  # time.monotonic() of the oldest pending notice
+        self._at_exit = False
+        self._timer = None  # threading.Timer that flushes the pending notices when the window ends
+        self._pending_lock = threading.Lock()  # The timer flushes from its own thread
+
+    @property
+    def _filename(self):
+        """ The events file name, for the file lock and version stamp of multi process mode """
+        return self.filename
+
+    def set_shared(self, shared=True):
+        """ Turns on multi process mode, as _Aggregator.set_shared(), for several processes using one events file.
+            Each change to the events is made holding the file lock, after taking in the changes saved by other
+            processes, and is saved before the lock is released. The events are restored now if the file exists
+        :param shared: bool: False turns multi process mode off"""
+
+        self.shared = shared
+        if shared and os.path.exists(json_filename(self.filename, self.compression)):
+            self.restore()
+
+    def sync(self):
+        """ In multi process mode, takes in the events saved by other processes since this one last read or wrote
+            the file. Events changed here since the last save (see touch()) keep their subscribers
+        :returns bool: True if there were changes to take in"""
+
+        if not self.shared:
+            return False
+        with self.lock():
+            stamp = self._read_stamp()
+            if stamp == self._stamp:
+                return False
+            saved = super().restore(self.filename)
+            changed = self._dirty if self._dirty is not None else set(self.events)
+            for event in [event for event in self.events if event not in saved and event not in changed]:
+                del self.events[event]
+            self.events.update((event, observers) for event, observers in saved.items() if event not in changed)
+            self._stamp = stamp
+            return True
+
+    def set_storage(self, storage):
+        """ Saves and restores the events with a storage backend in place of a JSON file.
+        :param storage: A storage backend, such as Storage.SqliteStorage(). None returns to JSON files"""
+        self._storage = storage
+        self._dirty = None
+
+    def touch(self, *events):
+        """ Records that the subscribers of events have changed, so the next save to a storage backend includes them
+            and sync() keeps them"""
+        if self._dirty is not None:
+            self._dirty.update(events)
 
     def save(self):
-        """Saves the events a JSON file"""
-        super().save_to_file(self.filename)
+        """Saves the events a JSON file, or the changed events to the storage backend"""
+        if self._storage is not None:
+            self._storage.save(self.filename, self.events, self._dirty)
+        elif self.shared:
+            with self.lock():
+                self.sync()  # Takes in changes saved by other processes, so they are not overwritten
+                super().save_to_file(self.filename)
+                self._write_stamp()
+        else:
+            super().save_to_file(self.filename)
+        self._dirty = set()
 
     def restore(self, file=''):
         """
-        Restores events from a JSON file
+        Restores events from a JSON file, or from the storage backend if one is set
 
         :raises: FileNotFound: If events JSON file is unavailable
         """
-        backup = self.events.copy()
         try:
-            self.events = super().restore(self.filename)
+            if self._storage is not None:
+                self._restored(self._storage.restore(self.filename))
+            else:
+                with self.lock():
+                    self._restored(super().restore(self.filename), self._read_stamp())
         except FileNotFoundError:
-            self.events = backup
+            # self.events is only replaced once the file has been read, so is left as it was
             print(f'Unable to restore from file {self.filename}')
 
+    def _restored(self, events, stamp=None):
+        """ Makes events read from file, or a storage backend, the current events with nothing left to save
+        :param events: dict: The events read
+        :param stamp: int: The version stamp of the JSON file read. None if read from a storage backend"""
+
+        self.events = events
+        self._dirty = set()
+        if stamp is not None:
+            self._stamp = stamp
+
     def _make_json_dict(self):
         """ :returns dict: Simply the 'self.events' dictionary """
         return self.events
@@ -68,10 +153,13 @@ class Subject(_JsonIO):
                             Added as a key(s) to self.events.
                             Key value =  list of observers subscribed to that event.
         """
-        for event in events:
-            if event not in self.events:
-                self.events[event] = []
-                self.save()
+        with self.lock():
+            self.sync()
+            for event in events:
+                if event not in self.events:
+                    self.events[event] = []
+                    self.touch(event)
+                    self.save()
 
     def del_events(self, *events):
         """
@@ -80,9 +168,12 @@ class Subject(_JsonIO):
 
         :param events: str: The event keys to be removed from 'self.events'
         """
-        for event in events:
-            self.events.pop(event, None)
-            self.save()
+        with self.lock():
+            self.sync()
+            for event in events:
+                self.events.pop(event, None)
+                self.touch(event)
+                self.save()
 
     def register(self, event, *observers):
         """
@@ -92,13 +183,16 @@ class Subject(_JsonIO):
         :param observers: str: A Member's unique id (or list of several) to be added to event's list
         :raises: KeyError: If no such event exists
         """
-        if event in self.events:
-            for ob in observers:
-                if ob not in self.events[event]:
-                    self.events[event].append(ob)
-                    self.save()
-        else:
-            raise KeyError(f'{event} list does not exist')
+        with self.lock():
+            self.sync()
+            if event in self.events:
+                for ob in observers:
+                    if ob not in self.events[event]:
+                        self.events[event].append(ob)
+                        self.touch(event)
+                        self.save()
+            else:
+                raise KeyError(f'{event} list does not exist')
 
     def deregister(self, event, observer):
         """
@@ -109,9 +203,136 @@ class Subject(_JsonIO):
         :raises: KeyError: If no such event exists
         """
 
-        if observer in self.get_observers(event):
-            self.get_observers(event).remove(observer)
-            self.save()
+        with self.lock():
+            self.sync()
+            if observer in self.get_observers(event):
+                self.get_observers(event).remove(observer)
+                self.touch(event)
+                self.save()
+
+    def prune(self, event, keep):
+        """
+        Removes the observers of an event that should no longer be subscribed, and any repeated observers
+
+        :param event: str: The name of an existing event
+        :param keep: set: The uids of the members that should stay subscribed
+        :return: int: The number of observers removed
+        """
+
+        self.sync()  # In multi process mode compact() holds the lock until the pruned events are saved
+        observers = self.events.get(event)
+        if observers is None:
+            return 0
+        kept = list(dict.fromkeys(observer for observer in observers if observer in keep))  # Also drops repeats
+        removed = len(observers) - len(kept)
+        if removed:
+            self.events[event] = kept
+            self.touch(event)
+        return removed
+
+    def compact(self, loans, reservations):
+        """
+        One off clean up of subscriptions left behind before members were unsubscribed automatically.
+            The 'Loans' event keeps the members with a book on loan and 'Reservations' the members with a
+            reservation. Other events are unchanged. Saves once if anything was removed
+
+        :param loans: Loans() instance
+        :param reservations: Reservations() instance
+        :return: dict: The number of observers removed from each event
+        """
+
+        with self.lock():
+            removed = {'Loans': self.prune('Loans', loans.borrowers()),
+                       'Reservations': self.prune('Reservations', reservations.holders())}
+            if any(removed.values()):
+                self.save()
+        return removed
+
+    def set_window(self, seconds=None):
+        """
+        Coalesces the notices for each member over a time window. Notices are held until the oldest pending notice
+            is seconds old, then each member is sent a single digest. A timer thread flushes them when the window
+            ends, so a notice is not left waiting for the next one. The window is also checked as each notice is
+            sent. Pending notices are also flushed when the interpreter exits
+
+        :param seconds: float: Length of the window. None sends notices as they are made, flushing any pending
+        """
+
+        self.window = seconds
+        if seconds is None:
+            self.flush()
+        elif not self._at_exit:
+            atexit.register(self.flush)
+            self._at_exit = True
+
+    @contextmanager
+    def coalesce(self):
+        """
+        Holds the notices sent inside the block and sends each member a single digest when the outermost block
+            ends. With a time window set they are only sent once the window has passed
+        """
+
+        self._coalescing += 1
+        try:
+            yield self
+        finally:
+            self._coalescing -= 1
+            with self._pending_lock:  # The timer thread may flush, and clear _held_since, at any moment
+                held_since = self._held_since if self._pending else None
+            if not self._coalescing and held_since is not None and (
+                    self.window is None or time.monotonic() - held_since >= self.window):
+                self.flush()
+
+    def flush(self):
+        """
+        Sends the pending notices. A member with one pending notice is sent it unchanged,
+            a member with several is sent a DigestNotification
+
+        :return: int: The number of messages sent
+        """
+
+        with self._pending_lock:
+            pending, self._pending, self._held_since = self._pending, {}, None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for member_uid, notices in pending.items():
+            member = self.lib_membership.search(member_uid)
+            member.send_email(notices[0] if len(notices) == 1 else DigestNotification(member, notices))
+        return len(pending)
+
+    def _hold(self, message):
+        """
+        Adds a notice for a subscribed member to the pending notices when coalescing.
+            Flushes if the time window has passed
+
+        :return: bool: True if the notice was held. False if it should be sent now
+        """
+
+        if message.all or (not self._coalescing and self.window is None):
+            return False
+        with self._pending_lock:
+            if not self._pending:
+                self._held_since = time.monotonic()
+            self._pending.setdefault(message.member.uid, []).append(message)
+            if self.window is not None and self._timer is None:
+                self._timer = threading.Timer(self.window, self._window_ended)
+                self._timer.daemon = True  # Pending notices at exit are left to the atexit flush
+                self._timer.start()
+            held_since = self._held_since
+        if (not self._coalescing and self.window is not None
+                and time.monotonic() - held_since >= self.window):
+            self.flush()
+        return True
+
+    def _window_ended(self):
+        """ Run by the timer when the window of the oldest pending notice ends. Flushes the pending notices unless
+            a coalesce() block is open, in which case the block flushes them as it ends """
+
+        with self._pending_lock:
+            self._timer = None
+        if not self._coalescing:
+            self.flush()
 
     def get_observers(self, event):
         """
@@ -134,5 +355,27 @@ class Subject(_JsonIO):
         :param message: Notification(). Class that holds the message and intended recipient(s)
 
         """
+        if not message.all and (self._coalescing or self.window is not None):
+            if message.member.uid in self.get_observers(event):
+                self._hold(message)
+            return
         for observer in self.get_observers(event):
             self.lib_membership.search(observer).send_email(message)
+
+    def send_emails(self, event, *messages):
+        """
+        Sends a batch of messages to the subscribers of the event.
+            The subscriber list is read once for the batch. Messages for a single member are passed straight
+            to that member rather than offered to every subscriber in turn
+
+        :param event: str:
+        :param messages: Notification(). Classes that hold a message and intended recipient(s)
+        """
+        observers = self.get_observers(event)
+        subscribed = set(observers)
+        for message in messages:
+            if message.all:
+                for observer in observers:
+                    self.lib_membership.search(observer).send_email(message)
+            elif message.member.uid in subscribed and not self._hold(message):
+                self.lib_membership.search(message.member.uid).send_email(message)
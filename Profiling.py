@@ -0,0 +1,128 @@
+"""
+Opt-in profiling of the interface operations.
+While enabled, a configurable fraction of calls to the public methods of LoansInterface, MembersInterface and
+ReservationInterface are run under cProfile and/or tracemalloc and the results written to a directory:
+
+    <directory>/<Class.method>-<n>.prof         cProfile stats, readable with pstats
+    <directory>/<Class.method>-<n>.tracemalloc  tracemalloc snapshot, readable with tracemalloc.Snapshot.load
+
+When disabled the wrappers are removed so there is no overhead. Metrics may wrap the same methods, and the two can
+be enabled and disabled in any order.
+"""
+
+import cProfile
+import importlib
+import os
+import random
+import tracemalloc
+from functools import wraps
+
+from Metrics import unwrap
+from Singleton import _Singleton
+
+# (module, class) whose public methods are profiled
+TARGETS = [('Interface', 'LoansInterface'),
+           ('Interface', 'MembersInterface'),
+           ('Interface', 'ReservationInterface')]
+
+MODES = ('cprofile', 'tracemalloc', 'both')
+
+
+class Profiler(_Singleton):
+    """
+    Samples interface calls for profiling. Inherits Singleton properties.
+
+        directory: str: Where the profile dumps are written
+        fraction: float: Fraction of calls profiled, between 0 and 1
+        mode: str: One of MODES
+        enabled: bool: True while the targets are wrapped
+        dumps: list of str: The files written since enabled
+    """
+
+    directory = 'profiles'
+    fraction = 1.0
+    mode = 'cprofile'
+    enabled = False
+    dumps = []
+    _wrappers = {}  # (class, method name) -> the wrapper installed
+    _calls = {}  # label -> number of calls profiled, used to name the dump files
+    _active = False  # True while a call is being profiled. Nested calls are not profiled separately
+    _random = random.Random()
+
+    def enable(self, directory='profiles', fraction=1.0, mode='cprofile', seed=None):
+        """
+        Starts profiling the interface operations
+
+        :param directory: str: Directory for the dump files. Created if it does not exist
+        :param fraction: float: Fraction of calls to profile, 1.0 profiles every call
+        :param mode: str: 'cprofile', 'tracemalloc' or 'both'
+        :param seed: int: Optional seed for the call sampling
+        :raises ValueError: If mode or fraction are invalid
+        """
+        if mode not in MODES:
+            raise ValueError(f'Profiler(): mode should be one of {MODES}')
+        if not 0 <= fraction <= 1:
+            raise ValueError('Profiler(): fraction should be between 0 and 1')
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fraction = fraction
+        self.mode = mode
+        self._random = random.Random(seed)
+        if self.enabled:
+            return
+
+        for module, cls_name in TARGETS:
+            cls = getattr(importlib.import_module(module), cls_name)
+            for name, func in list(cls.__dict__.items()):
+                if not name.startswith('_') and callable(func):
+                    wrapper = self._wrappers[(cls, name)] = self._profiled(f'{cls_name}.{name}', func)
+                    setattr(cls, name, wrapper)
+        self.enabled = True
+
+    def disable(self):
+        """ Stops profiling and removes the wrappers """
+        for (cls, name), wrapper in self._wrappers.items():
+            unwrap(cls, name, wrapper)
+        self._wrappers.clear()
+        self.enabled = False
+
+    def _profiled(self, label, func):
+        """:returns: func wrapped to profile a sample of its calls"""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            func = wrapper.__wrapped__  # Metrics may have removed a wrapper of its own beneath this one
+            if self._active or self._random.random() >= self.fraction:
+                return func(*args, **kwargs)
+            self._active = True
+            try:
+                return self._run(label, func, *args, **kwargs)
+            finally:
+                self._active = False
+        return wrapper
+
+    def _run(self, label, func, *args, **kwargs):
+        """ Calls func under the profilers for self.mode and writes the dumps """
+        self._calls[label] = self._calls.get(label, 0) + 1
+        path = os.path.join(self.directory, f'{label}-{self._calls[label]}')
+
+        tracing = self.mode in ('tracemalloc', 'both')
+        started_tracing = tracing and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile() if self.mode in ('cprofile', 'both') else None
+
+        try:
+            if profile:
+                return profile.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            if profile:
+                profile.dump_stats(path + '.prof')
+                self.dumps.append(path + '.prof')
+            if tracing:
+                tracemalloc.take_snapshot().dump(path + '.tracemalloc')
+                self.dumps.append(path + '.tracemalloc')
+            if started_tracing:
+                tracemalloc.stop()
@@ -0,0 +1,108 @@
+"""
+"Members who borrowed this also borrowed" recommendations.
+
+CoBorrowing keeps a sparse book x book co-occurrence matrix, as a dictionary of rows, counting the members who
+have borrowed both books of each pair. The top k books of each row are cached and a row's cache is dropped only
+when the row changes. A loan adds to the rows of the book and of the member's other books, so keeping the matrix up
+to date costs time in proportion to the new loans rather than to the whole history. New loans can be added directly
+or read from a Changes.ChangeStream with refresh().
+"""
+
+from heapq import nlargest
+
+
+class CoBorrowing:
+    def __init__(self, k=10):
+        """
+        Co-borrowing index.
+
+        :param k: int: Number of similar books cached for each book
+        """
+
+        self.k = k
+        self._borrowed = {}  # member_uid -> set of the book_uids they have borrowed
+        self._rows = {}  # book_uid -> {book_uid: number of members who borrowed both}
+        self._top = {}  # book_uid -> cached list of the top k (book_uid, count) pairs
+        self._cursor = None
+
+    @classmethod
+    def from_loans(cls, loans, k=10):
+        """
+        :param loans: Loans() instance
+        :param k: int: Number of similar books cached for each book
+        :returns: CoBorrowing() built from every loan in the store, including those archived
+        """
+
+        index = cls(k)
+        for loan_item in loans.history():
+            index.add(loan_item.book_uid, loan_item.member_uid)
+        return index
+
+    def add(self, book_uid, member_uid):
+        """
+        Records a loan. A member borrowing the same book again does not count twice
+
+        :param book_uid: int as str
+        :param member_uid: int as str
+        :returns bool: True if the member had not borrowed the book before
+        """
+
+        borrowed = self._borrowed.setdefault(member_uid, set())
+        if book_uid in borrowed:
+            return False
+        row = self._rows.setdefault(book_uid, {})
+        for other in borrowed:
+            row[other] = row.get(other, 0) + 1
+            other_row = self._rows[other]
+            other_row[book_uid] = other_row.get(book_uid, 0) + 1
+            self._top.pop(other, None)
+        self._top.pop(book_uid, None)
+        borrowed.add(book_uid)
+        return True
+
+    def follow(self, stream, since=None):
+        """
+        Reads new loans from a change stream on each refresh()
+
+        :param stream: Changes.ChangeStream() instance. It must be started before the loans to be read are made
+        :param since: int: Sequence number to read after. Defaults to the stream's current position
+        """
+
+        self._cursor = stream.cursor(since)
+
+    def refresh(self):
+        """
+        Adds the loans started since the last refresh, read from the stream given to follow()
+
+        :returns int: The number of loans read
+        :raises LookupError: If the stream no longer buffers some of the changes. Rebuild with from_loans()
+        """
+
+        count = 0
+        if self._cursor is not None:
+            for change in self._cursor:
+                if change.entity == 'LoanItem' and change.kind in ('loan_open', 'insert'):
+                    self.add(change.data['book_uid'], change.data['member_uid'])
+                    count += 1
+        return count
+
+    def similar(self, book_uid, k=None):
+        """
+        Finds the books most often borrowed by the members who borrowed a book
+
+        :param book_uid: int as str
+        :param k: int: Number of books. Defaults to self.k. Up to self.k the result is served from the cache
+        :return: List of (book_uid, count) tuples, highest count first. Ties are in book_uid order
+        """
+
+        if k is not None and k > self.k:
+            return self._rank(book_uid, k)
+        if book_uid not in self._top:
+            self._top[book_uid] = self._rank(book_uid, self.k)
+        return self._top[book_uid][:k]
+
+    def _rank(self, book_uid, k):
+        """:returns list: The top k (book_uid, count) pairs of a book's row"""
+
+        row = self._rows.get(book_uid, {})
+        return nlargest(k, row.items(), key=lambda item: (item[1], -int(item[0])))
@@ -2,8 +2,8 @@
 Classes that provide methods to create and maintain reservations between Member() and ReservationItem() instances
 """
 
-
-from Aggregator import _Aggregator
+import Changes
+from Aggregator import _Aggregator, _LazyCollection
 from DateStamp import Date
 from JsonIO import _JsonIO
 from Notifications import ResNotification
@@ -85,10 +85,12 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
             ReservationItems are stored in self.collection dictionary.
                 {Key = 'uid', Value = list of ReservationItem objects for that book}
                 Next member in a books reservation queue: first list item.
+            _hold_count maps the member_uid of each member with a reservation to their number of reservations
     """
 
     _filename = 'reservations'  # default file name for JsonIO Save and restore functions
-    collection = {}
+    _collection = {}  # See the collection property
+    _hold_count = {}  # member_uid -> number of reservations
 
     def __init__(self, library, membership, notify):
         """
@@ -103,6 +105,19 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
         self.lib_membership = membership
         self.notify = notify
 
+    @property
+    def collection(self):
+        """ dict: The reservations. Setting it rebuilds _hold_count, as Loans.collection does its indexes """
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        if isinstance(collection, _LazyCollection):
+            self._hold_count = {}
+        else:
+            self._reindex()
+
     def __str__(self):
         """ Unpacks self.collection for string calls """
         dct = {}
@@ -124,19 +139,47 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
                 self.collection[res_item.book_uid].append(res_item)
             else:
                 self.collection[res_item.book_uid] = [res_item]
+                self._index_key(res_item.book_uid)
+            self._count_holds(res_item.member_uid, 1)
+            self.touch(res_item.book_uid)
+            Changes.emit('insert', 'ReservationItem', res_item.book_uid, res_item)
         else:
             raise TypeError(f'Reservations(): {res_item} Must be type ReservationItem()')
         return
 
+    def sync(self):
+        """ Takes in changes saved by other processes then rebuilds the hold counts. See _Aggregator.sync() """
+        if super().sync():
+            self._reindex()
+            return True
+        return False
+
+    def _reindex(self):
+        """ Rebuilds self._hold_count from every reservation in self.collection """
+        self._hold_count = {}
+        for queue in self.collection.values():
+            for res_item in queue:
+                self._count_holds(res_item.member_uid, 1)
+
+    def _count_holds(self, member_uid, change):
+        """ Adds change to a member's number of reservations, removing members left with none """
+        count = self._hold_count.get(member_uid, 0) + change
+        if count > 0:
+            self._hold_count[member_uid] = count
+        else:
+            self._hold_count.pop(member_uid, None)
+
     def _make_json_dict(self):
         """
         :return: self.collection unpacked into a JSON compatible dict.
                     Keeps primary key. Values = the list of ReservationItem(s) converted to dictionaries
         """
-        dct = {}
+        return dict(self._json_items())
+
+    def _json_items(self):
+        """ Yields each key with its list of ReservationItem(s) as dictionaries, one key at a time """
         for key in self.collection:
-            dct[key] = [obj.as_json_dict() for obj in self.collection[key]]
-        return dct
+            yield key, [obj.as_json_dict() for obj in self.collection[key]]
 
     def make_reservation(self, book_uid, member_uid):
         """
@@ -157,14 +200,33 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
         :param member_uid: int as str
         """
         if book_uid in self.collection:
+            self.touch(book_uid)
 
             for index, res_item in enumerate(self.collection[book_uid]):
                 if res_item.member_uid == member_uid:
                     self.collection[book_uid].pop(index)
+                    self._count_holds(member_uid, -1)
                     break
             # Removes the key if its list of values is empty:
             if len(self.collection[book_uid]) == 0:
                 self.collection.pop(book_uid)
+                self._unindex_key(book_uid)
+            # Unsubscribes the member from reservation notices once they hold no other reservation
+            if not self.has_holds(member_uid):
+                self.notify.deregister('Reservations', member_uid)
+
+    def has_holds(self, member_uid):
+        """
+        :param member_uid: int as str
+        :return: Bool: True if the member has a reservation for any book
+        """
+        self._ensure_loaded()
+        return member_uid in self._hold_count
+
+    def holders(self):
+        """:return: set: The uids of the members with at least one reservation"""
+        self._ensure_loaded()
+        return set(self._hold_count)
 
     def next_res(self, book_uid):
         """
@@ -225,7 +287,7 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
         """
         return True if book_uid in self.collection else False
 
-    def status_update(self, book):
+    def status_update(self, book, notices=None):
         """
          Performs a status update when a book is checked in
                 If the book is reserved then sets the books status to reserved and
@@ -233,11 +295,16 @@ class Reservations(_Aggregator, _JsonIO, _Singleton):
                 Otherwise the book is made available
 
         :param book: BookItem() instance
+        :param notices: list: Optional. The ResNotification is appended to notices instead of being sent
         """
         if self.has_reservations(book.uid):
             book.set_reserved()
             res = self.next_res(book.uid)
             member = self.lib_membership.search(res.member_uid)
-            self.notify.send_email('Reservations', ResNotification(member, book, res))
+            notice = ResNotification(member, book, res)
+            if notices is None:
+                self.notify.send_email('Reservations', notice)
+            else:
+                notices.append(notice)
         else:
             book.set_available()
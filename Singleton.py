@@ -1,7 +1,8 @@
 class _Singleton:
     """An inherited Singleton class that allows one instance of a particular class to exist. The instances are
      stored in the class dictionary: _instances.
-    Each instantiation of a new class creates a new entry in _instances."""
+    Each instantiation of a new class creates a new entry in _instances.
+    A class may also have one instance per library branch, see branch_instance()."""
 
     _instances = {}
 
@@ -31,6 +32,31 @@ class _Singleton:
             cls()
         return cls._instances[str(cls)]
 
+    @classmethod
+    def branch_instance(cls, branch, *args, **kwargs):
+        """
+        Class method to return the instance of cls belonging to a library branch.
+            Each branch has its own instance, stored alongside the default instance under the key 'class@branch'.
+            If the instance does not exist, a new one is created with args and kwargs
+
+        :param branch: str: The name of the branch
+        :returns : the branch's instance of cls
+        """
+
+        key = f'{cls}@{branch}'
+        if key not in cls._instances:
+            instance = super().__new__(cls)
+            instance.__init__(*args, **kwargs)
+            instance.branch = branch
+            cls._instances[key] = instance
+        return cls._instances[key]
+
+    @classmethod
+    def branch_exists(cls, branch):
+        """ :param branch: str: The name of a branch
+        :returns : Bool: True if cls has an instance for the branch"""
+        return f'{cls}@{branch}' in cls._instances
+
     @staticmethod
     def instance_exists(item_cls):
         """ Tests to see if a particular singleton class has already been instantiated
@@ -0,0 +1,305 @@
+"""
+Storage backends for the stores, as an alternative to whole file JSON.
+
+A store hands a backend its name (the store's filename), its collection and the keys changed since the last save
+(see _Aggregator.touch). A backend writes only those keys, so the cost of a save follows the number of records
+changed rather than the size of the store.
+
+    SqliteStorage: Rows in an SQLite database
+    DeltaJsonStorage: A JSON snapshot, at first the store's usual JSON file, plus a small JSON segment per save
+"""
+
+import glob
+import json
+import os
+import re
+import shutil
+import sqlite3
+from abc import ABC, abstractmethod
+
+from JsonIO import CustomDecode, read_json, write_items
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    store TEXT NOT NULL,
+    key TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    book_uid TEXT,
+    member_uid TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (store, key, pos)
+);
+CREATE INDEX IF NOT EXISTS records_book ON records (store, book_uid);
+CREATE INDEX IF NOT EXISTS records_member ON records (store, member_uid);
+'''
+
+UPSERT = ('INSERT INTO records (store, key, pos, book_uid, member_uid, data) VALUES (?, ?, ?, ?, ?, ?) '
+          'ON CONFLICT (store, key, pos) DO UPDATE SET '
+          'book_uid = excluded.book_uid, member_uid = excluded.member_uid, data = excluded.data')
+TRIM = 'DELETE FROM records WHERE store = ? AND key = ? AND pos >= ?'
+DELETE_KEY = 'DELETE FROM records WHERE store = ? AND key = ?'
+DELETE_STORE = 'DELETE FROM records WHERE store = ?'
+SELECT_STORE = 'SELECT key, pos, data FROM records WHERE store = ? ORDER BY rowid'
+
+SINGLE = -1  # pos of the row for a key whose value is one object rather than a list
+
+
+class _Storage(ABC):
+    """ Interface for a storage backend """
+
+    @abstractmethod
+    def save(self, store, collection, keys=None):
+        """
+        Writes a store's records
+
+        :param store: str: Name of the store
+        :param collection: dict: The store's collection. Values are an object or a list of objects
+        :param keys: set: The keys to write. Keys no longer in collection are deleted. None writes every key
+        """
+
+    @abstractmethod
+    def restore(self, store):
+        """
+        :param store: str: Name of the store
+        :returns dict: The store's collection
+        """
+
+
+def _encode(item):
+    """:returns tuple: (book_uid, member_uid, JSON text) for an object, or a plain value, in a collection"""
+
+    if not hasattr(item, 'as_json_dict'):
+        return None, item, json.dumps(item)  # Subject events hold member uids
+    dct = item.as_json_dict()
+    book_uid = dct.get('book_uid', dct['uid'] if dct['class'] == '__BookItem__' else None)
+    member_uid = dct.get('member_uid', dct['uid'] if dct['class'] == '__Member__' else None)
+    return book_uid, member_uid, json.dumps(dct)
+
+
+class SqliteStorage(_Storage):
+    def __init__(self, database='library.db'):
+        """
+        Storage backend using an SQLite database (stdlib sqlite3) in WAL mode.
+            All stores share one 'records' table. Each object is a row keyed by (store, key, pos), where pos is the
+            object's position in a list value. book_uid and member_uid are indexed for lookups
+
+        :param database: str: The database file
+        """
+
+        self.database = database
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """ Closes the database connection """
+        self.connection.close()
+
+    def _rows(self, store, key, value):
+        """:returns list: The rows for one key of a collection"""
+
+        if isinstance(value, list):
+            return [(store, key, pos) + _encode(item) for pos, item in enumerate(value)]
+        return [(store, key, SINGLE) + _encode(value)]
+
+    def save(self, store, collection, keys=None):
+        """ Upserts the rows for keys in a single transaction. See _Storage.save() """
+
+        with self.connection:
+            if keys is None:
+                self.connection.execute(DELETE_STORE, (store,))
+                keys = collection.keys()
+            for key in keys:
+                if key not in collection:
+                    self.connection.execute(DELETE_KEY, (store, key))
+                    continue
+                value = collection[key]
+                self.connection.executemany(UPSERT, self._rows(store, key, value))
+                # Removes rows left over from a longer list, or a list that has become a single value
+                self.connection.execute(TRIM, (store, key, len(value) if isinstance(value, list) else 0))
+
+    def restore(self, store):
+        """ See _Storage.restore() """
+
+        collection = {}
+        for key, pos, data in self.connection.execute(SELECT_STORE, (store,)):
+            item = json.loads(data, object_hook=CustomDecode.dict_to_obj)
+            if pos == SINGLE:
+                collection[key] = item
+            else:
+                collection.setdefault(key, []).append(item)
+        return collection
+
+    def find(self, store, book_uid=None, member_uid=None):
+        """
+        Looks up a store's objects by book and/or member using the indexes
+
+        :param store: str: Name of the store
+        :param book_uid: int as str: Optional
+        :param member_uid: int as str: Optional
+        :returns list: The matching objects
+        """
+
+        query = 'SELECT data FROM records WHERE store = ?'
+        args = [store]
+        if book_uid is not None:
+            query += ' AND book_uid = ?'
+            args.append(book_uid)
+        if member_uid is not None:
+            query += ' AND member_uid = ?'
+            args.append(member_uid)
+        return [json.loads(data, object_hook=CustomDecode.dict_to_obj)
+                for data, in self.connection.execute(query + ' ORDER BY rowid', args)]
+
+
+class DeltaJsonStorage(_Storage):
+    def __init__(self, max_segments=50, max_ratio=0.5):
+        """
+        Storage backend that keeps a snapshot of a store plus a delta segment per later save holding only the
+            changed keys. restore() reads the snapshot and applies its segments in order.
+            The segments are compacted into a new snapshot once there are more than max_segments of them, or their
+            total size passes max_ratio of the snapshot's size.
+
+            Each compaction starts a new generation. Generation g > 0 has the snapshot '<store>.snapshot.<g>.json'
+            and the segments '<store>.delta.<g>.<n>.json'. Generation 0 is the store's usual JSON file, as written
+            by _JsonIO.save_to_file, with segments '<store>.delta.<n>.json', so the backend can take over a store
+            saved as JSON. restore() uses the newest snapshot and only its own generation's segments, so segments
+            left behind by a crash during compaction are never applied to a newer snapshot.
+            The store's JSON file is never removed. Each compaction copies the new snapshot over it, so it holds the
+            store as of the last compaction for readers of the plain JSON file
+
+        :param max_segments: int: Number of segments kept before compacting
+        :param max_ratio: float: Size of the segments, relative to the snapshot, that triggers compacting
+        """
+
+        self.max_segments = max_segments
+        self.max_ratio = max_ratio
+        self._segments = {}  # store -> [snapshot bytes, next segment number, segment bytes, generation]
+
+    @staticmethod
+    def _snapshot_file(store, generation):
+        """:returns str: The file name of a generation's snapshot"""
+
+        return store + '.json' if generation == 0 else f'{store}.snapshot.{generation}.json'
+
+    @staticmethod
+    def _segment_file(store, generation, number):
+        """:returns str: The file name of a generation's segment"""
+
+        return f'{store}.delta.{number}.json' if generation == 0 else f'{store}.delta.{generation}.{number}.json'
+
+    @staticmethod
+    def _files(store):
+        """:returns tuple: ({generation: snapshot file}, {generation: [segment files in the order written]})"""
+
+        snapshots = {0: store + '.json'} if os.path.exists(store + '.json') else {}
+        pattern = re.compile(re.escape(store) + r'\.snapshot\.(\d+)\.json')
+        for name in glob.glob(glob.escape(store) + '.snapshot.*.json'):
+            match = pattern.fullmatch(name)
+            if match:
+                snapshots[int(match.group(1))] = name
+        segments = {}
+        pattern = re.compile(re.escape(store) + r'\.delta\.(?:(\d+)\.)?(\d+)\.json')
+        for name in glob.glob(glob.escape(store) + '.delta.*.json'):
+            match = pattern.fullmatch(name)
+            if match:
+                segments.setdefault(int(match.group(1) or 0), []).append((int(match.group(2)), name))
+        return snapshots, {generation: [name for _, name in sorted(files)] for generation, files in segments.items()}
+
+    def _state(self, store):
+        """:returns list: [snapshot bytes, next segment number, segment bytes, generation] for a store,
+        read from disk once"""
+
+        if store not in self._segments:
+            snapshots, segments = self._files(store)
+            generation = max(snapshots, default=0)
+            files = segments.get(generation, [])
+            self._segments[store] = [os.path.getsize(snapshots[generation]) if snapshots else 0, len(files),
+                                     sum(os.path.getsize(name) for name in files), generation]
+        return self._segments[store]
+
+    @staticmethod
+    def _write(filename, data):
+        """ Writes data as JSON to a temporary file then renames it, so a reader never sees a partial file
+        :param data: dict, or a generator of (key, value) pairs written one at a time
+        :returns int: The bytes written"""
+
+        with open(filename + '.tmp', mode='w', encoding='utf-8-sig') as file:
+            if isinstance(data, dict):
+                json.dump(data, file)
+            else:
+                write_items(file, data)
+            size = file.tell()
+        os.replace(filename + '.tmp', filename)
+        return size
+
+    def save(self, store, collection, keys=None):
+        """ Writes the changed keys as a new segment, or a new snapshot if keys is None or the segments need
+            compacting. See _Storage.save() """
+
+        state = self._state(store)
+        if keys is None or state[1] >= self.max_segments or state[2] > self.max_ratio * state[0]:
+            self.compact(store, collection)
+            return
+        if not keys:
+            return
+        segment = {'set': {key: _plain(collection[key]) for key in keys if key in collection},
+                   'deleted': [key for key in keys if key not in collection]}
+        state[2] += self._write(self._segment_file(store, state[3], state[1]), segment)
+        state[1] += 1
+
+    def compact(self, store, collection):
+        """
+        Writes collection as the snapshot of a new generation, copies it over the store's JSON file, then removes
+            the older generations' files. The new snapshot takes effect when it is renamed into place. A crash
+            before then leaves the old generation whole, a crash after it leaves files restore() ignores and the
+            next compaction removes
+
+        :param store: str: Name of the store
+        :param collection: dict: The store's whole collection
+        """
+
+        generation = self._state(store)[3] + 1
+        size = self._write(self._snapshot_file(store, generation),
+                           ((key, _plain(value)) for key, value in collection.items()))
+        self._segments[store] = [size, 0, 0, generation]
+        shutil.copyfile(self._snapshot_file(store, generation), store + '.json.tmp')
+        os.replace(store + '.json.tmp', store + '.json')
+        self._remove_old(store, generation)
+
+    def _remove_old(self, store, generation):
+        """ Removes the snapshots and segments of the generations before generation. The store's JSON file, the
+            generation 0 snapshot, is kept """
+
+        snapshots, segments = self._files(store)
+        for old in snapshots:
+            if 0 < old < generation:
+                os.remove(snapshots[old])
+        for old, names in segments.items():
+            if old < generation:
+                for name in names:
+                    os.remove(name)
+
+    def restore(self, store):
+        """ Reads the newest snapshot and applies its generation's segments in order. See _Storage.restore() """
+
+        snapshots, segments = self._files(store)
+        generation = max(snapshots, default=0)
+        collection = read_json(snapshots[generation][:-len('.json')]) if snapshots else {}
+        for name in segments.get(generation, []):
+            with open(name, encoding='utf-8-sig') as file:
+                segment = json.load(file, object_hook=CustomDecode.dict_to_obj)
+            collection.update(segment['set'])
+            for key in segment['deleted']:
+                collection.pop(key, None)
+        self._segments.pop(store, None)
+        return collection
+
+
+def _plain(value):
+    """:returns: A collection value as JSON compatible dictionaries and lists"""
+
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value.as_json_dict() if hasattr(value, 'as_json_dict') else value
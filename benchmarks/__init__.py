@@ -0,0 +1,16 @@
+"""
+Benchmarks for the library system.
+
+    generate.py: Seeded generator for scaled books.csv, members.csv and bookloans.csv files
+    run.py: Timed scenarios over the generated data. Results are written as JSON
+    startup.py: Import time and first query latency, eager and on demand restore
+    replay.py: Replays a recorded or synthetic stream of operations against the interfaces with a fake clock
+    storage.py: Replays the same stream with the JSON, SQLite and delta JSON storage
+        backends side by side
+    keys.py: Memory and lookup time of the key schemes considered for the Loans collection
+    contention.py: Kiosk processes sharing one working directory. Lost update rate and throughput
+    catalogue.py: Worker processes looking up books from their own Library or from one SharedCatalogue
+
+Run from the repository root so the library modules can be imported, e.g.
+    python -m benchmarks.run --books 10000 --members 20000 --loans 100000 --output results.json
+"""
@@ -0,0 +1,106 @@
+"""
+Worker processes answering catalogue lookups, each from its own copy of the Library or from one SharedCatalogue.
+
+In 'copy' mode each worker restores the Library from books.json, as a separate process does today. In 'shared' mode
+the parent exports the Library once and each worker attaches to the segment. Every worker then looks up the status
+of random books. Reports, per mode, the memory each worker allocates to set up its catalogue, the setup time and
+the time per lookup, and the size of the shared segment.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.generate import generate
+from benchmarks.run import _commit, build_system, reset_stores
+
+
+def _worker(args):
+    """ Sets up a catalogue and makes random status lookups. Run in a child process
+    :returns dict: Bytes allocated by the setup, its time and the lookup time"""
+
+    directory, mode, name, lookups, books, seed = args
+    os.chdir(directory)
+    rng = random.Random(seed)
+    uids = [str(rng.randint(1, books)) for _ in range(lookups)]
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        began = time.perf_counter()
+        if mode == 'shared':
+            from Catalogue import SharedCatalogue
+            catalogue = SharedCatalogue.attach(name)
+            status = catalogue.status
+        else:
+            from Library import Library
+            reset_stores()
+            catalogue = Library.get_instance()
+            catalogue.restore()
+            status = lambda uid: catalogue.search(uid).status
+        setup = time.perf_counter() - began
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    began = time.perf_counter()
+    for uid in uids:
+        status(uid)
+    seconds = time.perf_counter() - began
+    if mode == 'shared':
+        catalogue.close()
+    return {'bytes': held, 'setup_seconds': setup, 'lookup_seconds': seconds}
+
+
+def run(processes=4, lookups=100000, books=10000, members=1000, loans=1000, seed=1):
+    """:returns dict: JSON compatible results"""
+
+    from Catalogue import SharedCatalogue
+
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, books, members, loans, seed)
+        os.chdir(directory)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                library = build_system('.')['library']
+                library.save()
+            with SharedCatalogue.export(library) as catalogue:
+                segment = catalogue._shm.size
+                reset_stores()  # The workers start without the parent's copy
+                for mode in ('copy', 'shared'):
+                    with multiprocessing.get_context('fork').Pool(processes) as pool:
+                        workers = pool.map(_worker, [(directory, mode, catalogue.name, lookups, books, seed + index)
+                                                     for index in range(processes)])
+                    seconds = sum(worker['lookup_seconds'] for worker in workers)
+                    results[mode] = {'bytes_per_worker': max(worker['bytes'] for worker in workers),
+                                     'setup_seconds': max(worker['setup_seconds'] for worker in workers),
+                                     'per_lookup': seconds / (lookups * processes)}
+            results['shared']['segment_bytes'] = segment
+        finally:
+            os.chdir(cwd)
+
+    return {'commit': _commit(),
+            'params': {'processes': processes, 'lookups': lookups, 'books': books, 'seed': seed},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalogue lookups from per process copies or shared memory')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=100000, help='Lookups per process')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    json.dump(run(args.processes, args.lookups, args.books, seed=args.seed), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Several processes serving kiosks from the same working directory.
+
+Each process restores the stores from the shared JSON files and then makes random checkouts and returns. In multi
+process mode (see _Aggregator.set_shared) every operation runs in a transaction. Without it (--unsafe) each process
+overwrites the files with its own copy of the stores. Once the processes finish, the files are checked against the
+loans each process saw succeed. A lost update is a loan, or a return, that succeeded but is missing from the files.
+The processes share one events file, and a borrower missing from its 'Loans' subscribers is a lost subscription.
+The report gives the lost update rate and the throughput, with the number of books and members whose state disagrees
+with the open loans before and after the run.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.generate import generate
+from benchmarks.run import _commit, build_system, reset_stores
+
+STORES = ('library', 'membership', 'loans', 'reservations')
+
+
+def _open_system(shared):
+    """ Restores the stores and events from the JSON files in the current directory and wires up the interfaces
+    :param shared: bool: Use multi process mode
+    :returns dict: The stores and interfaces keyed by name"""
+
+    from Interface import LoansInterface
+    from Library import Library
+    from Loans import Loans
+    from Membership import Membership
+    from Observer import Subject
+    from Reservations import Reservations
+
+    reset_stores()
+    library, membership, loans = Library.get_instance(), Membership.get_instance(), Loans.get_instance()
+    notify = Subject(membership)
+    reservations = Reservations(library, membership, notify)
+    system = {'library': library, 'membership': membership, 'loans': loans, 'reservations': reservations,
+              'notify': notify}
+    for name in STORES + ('notify',):
+        if shared:
+            system[name].set_shared()
+        else:
+            system[name].restore()
+    system['loans_interface'] = LoansInterface(loans, membership, library, reservations, notify)
+    return system
+
+
+def _worker(args):
+    """ Runs ops random checkouts and returns. Run in a child process
+    :returns dict: Loans started and ended per 'book-member' key, as seen by this process, and the time taken"""
+
+    from Aggregator import transaction
+
+    directory, index, ops, books, members, shared, seed = args
+    os.chdir(directory)
+    rng = random.Random(seed + index)
+    started, ended = Counter(), Counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        system = _open_system(shared)
+        library, membership, loans = system['library'], system['membership'], system['loans']
+        interface = system['loans_interface']
+        began = time.perf_counter()
+        for _ in range(ops):
+            # The outer transaction makes the before and after checks atomic with the operation in multi process mode
+            with transaction(*(system[name] for name in STORES)):
+                book = library.search(str(rng.randint(1, books)))
+                holder = loans.on_loan_to(book.uid)
+                if holder is None:
+                    member = membership.search(str(rng.randint(1, members)))
+                    key = (book.uid, member.uid)
+                    before = len(loans.collection.get(key, []))
+                    interface.checkout_books(member, book)
+                    if len(loans.collection.get(key, [])) > before:
+                        started['-'.join(key)] += 1
+                else:
+                    if interface.return_book_drop(book):
+                        ended[f'{book.uid}-{holder}'] += 1
+        seconds = time.perf_counter() - began
+    return {'started': started, 'ended': ended, 'seconds': seconds, 'ops': ops}
+
+
+def _check(before, results):
+    """ Compares the saved stores and events with the loans the processes saw succeed
+    :param before: dict: 'book-member' key -> (loans, returned loans) before the run
+    :returns dict: Counts of lost loans, lost returns and lost subscriptions. A lost subscription is a member with
+            a loan started in the run, and still open, who is not subscribed to 'Loans'"""
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        system = _open_system(False)
+    after = _loan_counts(system['loans'])
+    subscribed = set(system['notify'].get_observers('Loans'))
+
+    started, ended = Counter(), Counter()
+    for result in results:
+        started.update(result['started'])
+        ended.update(result['ended'])
+    lost_loans = sum(max(0, before.get(key, (0, 0))[0] + count - after.get(key, (0, 0))[0])
+                     for key, count in started.items())
+    lost_returns = sum(max(0, before.get(key, (0, 0))[1] + count - after.get(key, (0, 0))[1])
+                       for key, count in ended.items())
+    borrowers = set()
+    for key in started:
+        book_uid, member_uid = key.split('-')
+        if system['loans'].on_loan_to(book_uid) == member_uid:
+            borrowers.add(member_uid)
+    return {'lost_loans': lost_loans, 'lost_returns': lost_returns,
+            'lost_subscriptions': len(borrowers - subscribed), 'loans_started': sum(started.values()),
+            'loans_ended': sum(ended.values())}
+
+
+def _inconsistent(system):
+    """:returns tuple: Numbers of books and members whose status or number of loans disagrees with the open loans.
+    The generated data starts with some, as bookloans.csv is generated independently of the other files"""
+
+    loans, library, membership = system['loans'], system['library'], system['membership']
+    open_loans = Counter()
+    on_loan = set()
+    for loan_items in loans.collection.values():
+        if int(loan_items[-1].return_date.date) == 0:
+            open_loans[loan_items[-1].member_uid] += 1
+            on_loan.add(loan_items[-1].book_uid)
+    books = sum(1 for uid, book in library.collection.items() if book.is_on_loan() != (uid in on_loan))
+    members = sum(1 for uid, member in membership.collection.items()
+                  if int(member.no_of_loans) != open_loans.get(uid, 0))
+    return books, members
+
+
+def _loan_counts(loans):
+    """:returns dict: 'book-member' key -> (number of loans, number returned)"""
+    return {'-'.join(key): (len(items), sum(1 for item in items if int(item.return_date.date)))
+            for key, items in loans.collection.items()}
+
+
+def run(processes=4, ops=200, books=200, members=400, loans=1000, seed=1, shared=True):
+    """:returns dict: JSON compatible results"""
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, books, members, loans, seed)
+        os.chdir(directory)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                system = build_system('.')
+                for name in STORES + ('notify',):
+                    system[name].save()
+            before = _loan_counts(system['loans'])
+            inconsistent_before = _inconsistent(system)
+
+            began = time.perf_counter()
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.map(_worker, [(directory, index, ops, books, members, shared, seed)
+                                             for index in range(processes)])
+            elapsed = time.perf_counter() - began
+            check = _check(before, results)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                inconsistent_after = _inconsistent(_open_system(False))
+        finally:
+            os.chdir(cwd)
+
+    lost = check['lost_loans'] + check['lost_returns']
+    succeeded = check['loans_started'] + check['loans_ended']
+    return {'commit': _commit(), 'shared': shared,
+            'params': {'processes': processes, 'ops': ops, 'books': books, 'members': members, 'loans': loans,
+                       'seed': seed},
+            'throughput': processes * ops / elapsed, 'seconds': elapsed,
+            'lost_update_rate': lost / succeeded if succeeded else 0.0, **check,
+            'inconsistent_books': [inconsistent_before[0], inconsistent_after[0]],
+            'inconsistent_members': [inconsistent_before[1], inconsistent_after[1]]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kiosk processes sharing one working directory')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=200, help='Operations per process')
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument('--members', type=int, default=400)
+    parser.add_argument('--loans', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--unsafe', action='store_true', help='Run without multi process mode, for comparison')
+    args = parser.parse_args()
+    json.dump(run(args.processes, args.ops, args.books, args.members, args.loans, args.seed, not args.unsafe),
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Seeded generator for synthetic library data in the same formats as the provided csv files.
+The same seed and sizes always produce the same files.
+"""
+
+import argparse
+import csv
+import os
+import random
+
+GENRES = {'tech': ['signal_processing', 'data_science', 'programming', 'mathematics'],
+          'science': ['physics', 'biology', 'chemistry'],
+          'fiction': ['classic', 'novel', 'crime'],
+          'nonfiction': ['history', 'philosophy', 'economics']}
+PUBLISHERS = ['Wiley', 'Penguin', 'Springer', 'HarperCollins', 'Random House', 'Apress']
+FIRST_NAMES = ['Adelaide', 'Charlie', 'Eleanor', 'Ted', 'Sophia', 'Oscar', 'Lily', 'Harry', 'Grace', 'Jack']
+LAST_NAMES = ['Cunningham', 'Roberts', 'Douglas', 'Hill', 'Ellis', 'Murphy', 'Wells', 'Carter', 'Adams']
+WORDS = ['Data', 'Theory', 'Learning', 'History', 'Nature', 'Art', 'Practice', 'Mind', 'World', 'Code',
+         'Signals', 'Science', 'Modern', 'Life', 'Systems', 'Design']
+
+FIRST_LOAN_DATE = 43466  # 01/01/2019 in Excel format
+OPEN_LOAN_CHANCE = 0.3  # Chance the last loan of a book is still open
+
+
+def write_books(filename, count, rng):
+    """ Writes count books with a header row, as books.csv
+    :param filename: str: The csv file to write
+    :param count: int: Number of books
+    :param rng: random.Random(): Seeded generator"""
+
+    with open(filename, mode='w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Number', 'Title', 'Author', 'Genre', 'SubGenre', 'Publisher'])
+        for uid in range(1, count + 1):
+            genre = rng.choice(list(GENRES))
+            writer.writerow([uid, ' '.join(rng.choices(WORDS, k=rng.randint(2, 4))),
+                             f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}',
+                             genre, rng.choice(GENRES[genre]), rng.choice(PUBLISHERS)])
+
+
+def write_members(filename, count, rng):
+    """ Writes count members with a header row, as members.csv
+    :param filename: str: The csv file to write
+    :param count: int: Number of members
+    :param rng: random.Random(): Seeded generator"""
+
+    with open(filename, mode='w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(['ID', 'First Name', 'Last Name', 'Gender', 'Email', 'CardNumber'])
+        for uid in range(1, count + 1):
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = rng.choice(LAST_NAMES)
+            writer.writerow([uid, first_name, last_name, rng.choice(['Female', 'Male']),
+                             f'{first_name[0].lower()}.{last_name.lower()}{uid}@randatmail.com',
+                             f'{uid}{rng.randint(1, 3)}'])
+
+
+def write_loans(filename, count, books, members, rng):
+    """ Writes count loans without a header row, as bookloans.csv
+        Each book's loans follow one another in time. The last loan of a book may still be open (return date 0)
+
+    :param filename: str: The csv file to write
+    :param count: int: Number of loans
+    :param books: int: Number of books to loan
+    :param members: int: Number of borrowing members
+    :param rng: random.Random(): Seeded generator"""
+
+    next_free = [FIRST_LOAN_DATE] * (books + 1)  # The first day each book is back on the shelf
+    loaned = [0] * (books + 1)
+    per_book = [0] * (books + 1)
+    for _ in range(count):
+        per_book[rng.randint(1, books)] += 1
+
+    with open(filename, mode='w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        for book_uid in range(1, books + 1):
+            for _ in range(per_book[book_uid]):
+                start_date = next_free[book_uid] + rng.randint(0, 10)
+                return_date = start_date + rng.randint(1, 30)
+                next_free[book_uid] = return_date + 1
+                loaned[book_uid] += 1
+                if loaned[book_uid] == per_book[book_uid] and rng.random() < OPEN_LOAN_CHANCE:
+                    return_date = 0
+                writer.writerow([book_uid, rng.randint(1, members), start_date, return_date])
+
+
+def generate(directory, books=1000, members=2000, loans=20000, seed=1):
+    """ Generates books.csv, members.csv and bookloans.csv in directory
+
+    :param directory: str: Output directory. Created if it does not exist
+    :param books: int: Number of books
+    :param members: int: Number of members
+    :param loans: int: Number of loans
+    :param seed: int: Seed for the random generator
+    :returns dict: The file names written, keyed by store"""
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    files = {'books': os.path.join(directory, 'books.csv'),
+             'members': os.path.join(directory, 'members.csv'),
+             'loans': os.path.join(directory, 'bookloans.csv')}
+    write_books(files['books'], books, rng)
+    write_members(files['members'], members, rng)
+    write_loans(files['loans'], loans, books, members, rng)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic library csv files')
+    parser.add_argument('directory')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.directory, args.books, args.members, args.loans, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares the key schemes for the Loans collection: 'book-member' strings, as used before, (book, member) tuples of
+interned uids, as used now, and the two uids packed into one int.
+Reports the memory held by the keys and the time to build each key and look it up from a pair of uid strings, the
+form the interfaces pass to Loans.search.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from benchmarks.run import _commit
+
+SCHEMES = {'string': lambda book_uid, member_uid: book_uid + '-' + member_uid,
+           'tuple': lambda book_uid, member_uid: (book_uid, member_uid),
+           'packed': lambda book_uid, member_uid: int(book_uid) << 32 | int(member_uid)}
+
+
+def run(books=10000, members=20000, loans=100000, lookups=200000, seed=1):
+    """:returns dict: JSON compatible results for each key scheme"""
+
+    rng = random.Random(seed)
+    pairs = [(sys.intern(str(rng.randint(1, books))), sys.intern(str(rng.randint(1, members))))
+             for _ in range(loans)]
+    # Uids as they arrive from a BookItem or Member rather than from the interned loan data
+    probes = [(str(int(book_uid)), str(int(member_uid))) for book_uid, member_uid in rng.choices(pairs, k=lookups)]
+
+    results = {}
+    for name, make_key in SCHEMES.items():
+        tracemalloc.start()
+        collection = {make_key(book_uid, member_uid): None for book_uid, member_uid in pairs}
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for book_uid, member_uid in probes:
+            collection.get(make_key(book_uid, member_uid))
+        seconds = time.perf_counter() - start
+        results[name] = {'bytes': held, 'lookup_seconds': seconds, 'per_lookup': seconds / lookups}
+        del collection
+    return {'commit': _commit(), 'params': {'books': books, 'members': members, 'loans': loans, 'lookups': lookups,
+                                             'seed': seed},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare key schemes for the Loans collection')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--loans', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    json.dump(run(args.books, args.members, args.loans, args.lookups, args.seed), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
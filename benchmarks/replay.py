@@ -0,0 +1,245 @@
+"""
+Replays a stream of library operations against the interfaces to reproduce production load.
+
+The stream is a JSON lines file, one operation per line:
+
+    {"op": "checkout", "day": 45000, "member": "12", "books": ["5", "7"]}
+    {"op": "return", "day": 45001, "books": ["5"]}
+    {"op": "reserve", "day": 45001, "member": "3", "book": "7"}
+    {"op": "add_member", "day": 45002, "first_name": "Ann", "last_name": "Lee", "gender": "Female", "email": "a@b"}
+    {"op": "update_card", "day": 45003, "member": "12"}
+
+"day" is the Excel format date the operation happens on. Date() reads a fake clock set to that day.
+A synthetic stream can be generated from a seed instead. Operations run as fast as possible or at a fixed
+rate. The persistence backend is chosen from BACKENDS. The report gives throughput and latency percentiles
+for each operation type.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate
+from benchmarks.run import _commit, build_system
+from DateStamp import Date
+
+START_DAY = 45000  # Excel format date a synthetic stream starts on
+OPS_PER_DAY = 200  # Synthetic operations per simulated day
+
+
+class FakeClock:
+    """ Stands in for time.time as Date.clock. Returns midday of self.day """
+
+    def __init__(self, day=START_DAY):
+        """:param day: int: Excel format date"""
+        self.day = day
+
+    def __call__(self):
+        # Inverse of Date._system_to_excel. Excel counts 29/02/1900, which did not exist
+        days = self.day - Date._diff_in_days() - (1 if self.day > 59 else 0)
+        return days * 60 * 60 * 24 + 60 * 60 * 12
+
+
+def _memory(system):
+    """ Persistence backend that keeps everything in memory. Replaces each store's save with a no-op """
+    for name in ('library', 'membership', 'loans', 'reservations', 'notify', 'members_interface'):
+        system[name].save = lambda: None
+
+
+def _json(system):
+    """ Persistence backend that saves to JSON files, the default for the stores """
+
+
+def _sqlite(system):
+    """ Persistence backend that saves the changed records to an SQLite database. The stores are written to the
+        database in full before the replay starts """
+    from Storage import SqliteStorage
+
+    storage = SqliteStorage('library.db')
+    for name in ('library', 'membership', 'loans', 'reservations', 'notify'):
+        system[name].set_storage(storage)
+        system[name].save()
+
+
+def _delta(system):
+    """ Persistence backend that keeps each store's JSON file as a snapshot and saves the changed records as
+        small delta segments beside it """
+    from Storage import DeltaJsonStorage
+
+    storage = DeltaJsonStorage()
+    for name in ('library', 'membership', 'loans', 'reservations', 'notify'):
+        system[name].set_storage(storage)
+        system[name].save()
+
+
+BACKENDS = {'json': _json, 'memory': _memory, 'sqlite': _sqlite, 'delta': _delta}
+
+
+def synthesize(books, members, count, seed=1):
+    """
+    Generates a synthetic stream of operations. A simple model of which books are on loan keeps most operations
+        valid, although the system may still refuse some (fines, loan limits, reservations)
+
+    :param books: int: Number of books in the catalogue
+    :param members: int: Number of members
+    :param count: int: Number of operations
+    :param seed: int: Seed for the random generator
+    :returns list: Operations as dictionaries
+    """
+
+    rng = random.Random(seed)
+    available = set(range(1, books + 1))
+    on_loan = []
+    ops = []
+    weights = {'checkout': 40, 'return': 35, 'reserve': 15, 'add_member': 5, 'update_card': 5}
+    for n in range(count):
+        day = START_DAY + n // OPS_PER_DAY
+        op = rng.choices(list(weights), list(weights.values()))[0]
+        if op == 'checkout' and available:
+            book = rng.choice(tuple(available)) if len(available) < 1000 else rng.randint(1, books)
+            if book in available:
+                available.discard(book)
+                on_loan.append(book)
+            ops.append({'op': op, 'day': day, 'member': str(rng.randint(1, members)), 'books': [str(book)]})
+        elif op == 'return' and on_loan:
+            book = on_loan.pop(rng.randrange(len(on_loan)))
+            available.add(book)
+            ops.append({'op': op, 'day': day, 'books': [str(book)]})
+        elif op == 'add_member':
+            members += 1
+            ops.append({'op': op, 'day': day, 'first_name': 'Replay', 'last_name': f'Member{members}',
+                        'gender': rng.choice(['Female', 'Male']), 'email': f'replay{members}@randatmail.com'})
+        elif op == 'update_card':
+            ops.append({'op': op, 'day': day, 'member': str(rng.randint(1, members))})
+        else:
+            ops.append({'op': 'reserve', 'day': day, 'member': str(rng.randint(1, members)),
+                        'book': str(rng.randint(1, books))})
+    return ops
+
+
+def _apply(system, op):
+    """ Runs a single operation through the interfaces """
+
+    library, membership = system['library'], system['membership']
+    name = op['op']
+    if name == 'checkout':
+        system['loans_interface'].checkout_books(membership.search(op['member']),
+                                                 *(library.search(uid) for uid in op['books']))
+    elif name == 'return':
+        system['loans_interface'].return_books(*(library.search(uid) for uid in op['books']))
+    elif name == 'reserve':
+        system['reservation_interface'].make_reservation(membership.search(op['member']), op['book'])
+    elif name == 'add_member':
+        system['members_interface'].add_member(**{key: value for key, value in op.items()
+                                                  if key not in ('op', 'day')})
+    elif name == 'update_card':
+        system['members_interface'].update_card(op['member'])
+    else:
+        raise ValueError(f'Unknown operation: {name}')
+
+
+def _percentile(ordered, fraction):
+    """:returns float: The value at fraction through the sorted list, nearest rank"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay(system, ops, rate=None):
+    """
+    Drives the interfaces with a stream of operations using a fake clock
+
+    :param system: dict: Stores and interfaces, see benchmarks.run.build_system
+    :param ops: iterable of dict: The operations
+    :param rate: float: Operations per second. None runs as fast as possible
+    :returns dict: Throughput, error count and latency percentiles per operation type
+    """
+
+    clock = FakeClock()
+    real_clock = Date.clock
+    Date.clock = clock
+    latencies = {}
+    errors = {}
+    count = 0
+    began = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for op in ops:
+                if rate:
+                    delay = began + count / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                clock.day = op.get('day', clock.day)
+                start = time.perf_counter()
+                try:
+                    _apply(system, op)
+                except Exception:
+                    errors[op['op']] = errors.get(op['op'], 0) + 1
+                latencies.setdefault(op['op'], []).append(time.perf_counter() - start)
+                count += 1
+    finally:
+        Date.clock = real_clock
+    elapsed = time.perf_counter() - began
+
+    report = {}
+    for name, values in latencies.items():
+        values.sort()
+        report[name] = {'count': len(values), 'errors': errors.get(name, 0),
+                        'p50': _percentile(values, 0.5), 'p90': _percentile(values, 0.9),
+                        'p99': _percentile(values, 0.99), 'max': values[-1], 'mean': sum(values) / len(values)}
+    return {'ops': count, 'seconds': elapsed, 'throughput': count / elapsed if elapsed else None,
+            'operations': report}
+
+
+def read_ops(filename):
+    """:returns generator: The operations in a JSON lines file"""
+    with open(filename, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay library operations against the interfaces')
+    parser.add_argument('--ops-file', help='JSON lines file of operations. Defaults to a synthetic stream')
+    parser.add_argument('--synthetic', type=int, default=2000, help='Number of synthetic operations')
+    parser.add_argument('--write-ops', help='Write the synthetic stream to this file and exit')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate', type=float, help='Operations per second. Default: as fast as possible')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='json')
+    args = parser.parse_args()
+
+    if args.write_ops:
+        with open(args.write_ops, mode='w', encoding='utf-8') as file:
+            for op in synthesize(args.books, args.members, args.synthetic, args.seed):
+                file.write(json.dumps(op) + '\n')
+        return
+
+    ops = list(read_ops(os.path.abspath(args.ops_file))) if args.ops_file else \
+        synthesize(args.books, args.members, args.synthetic, args.seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, args.books, args.members, args.loans, args.seed)
+        os.chdir(directory)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                system = build_system('.')
+                system['notify'].save()
+            BACKENDS[args.backend](system)
+            results = replay(system, ops, args.rate)
+        finally:
+            os.chdir(cwd)
+
+    results.update({'commit': _commit(), 'backend': args.backend, 'rate': args.rate})
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+Timed benchmark scenarios for the library system.
+
+Each scenario runs against data from benchmarks.generate in a temporary working directory, as the stores
+save and restore their JSON files in the current directory. Console output from the system is suppressed.
+The results are emitted as JSON so runs from different commits can be compared.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate
+
+BOOK_FIELDS = ['uid', 'title', 'author', 'genre', 'subgenre', 'publisher']
+MEMBER_FIELDS = ['uid', 'first_name', 'last_name', 'gender', 'email', 'card_number']
+LOAN_FIELDS = ['book_uid', 'member_uid', 'start_date', 'return_date']
+
+
+def reset_stores():
+    """ Empties the singleton stores so a scenario starts from a known state """
+
+    from Library import Library
+    from Loans import Loans
+    from Membership import Membership
+    from Reservations import Reservations
+
+    for cls in (Library, Membership):
+        cls.collection = {}
+    for cls in (Loans, Reservations):
+        cls._collection = {}  # Their collection is a property over it
+    for cls in (Library, Membership, Loans, Reservations):
+        if str(cls) in cls._instances:
+            cls._instances[str(cls)].reset()  # Also rebuilds the indexes of Loans and Reservations
+
+
+def build_system(directory='.'):
+    """ Loads the csv files in directory into the stores and wires up the interfaces
+
+    :param directory: str: Directory holding books.csv, members.csv and bookloans.csv
+    :returns dict: The stores and interfaces keyed by name"""
+
+    from Interface import LoansInterface, MembersInterface, ReservationInterface
+    from Library import Library
+    from Loans import Loans
+    from Membership import Membership
+    from Observer import Subject
+    from Reservations import Reservations
+
+    reset_stores()
+    library = Library.get_instance()
+    membership = Membership.get_instance()
+    loans = Loans.get_instance()
+    library.read_csv(os.path.join(directory, 'books.csv'), Start_line='1', Fields=BOOK_FIELDS)
+    membership.read_csv(os.path.join(directory, 'members.csv'), Start_line='1', Fields=MEMBER_FIELDS)
+    loans.read_csv(os.path.join(directory, 'bookloans.csv'), Start_line='0', Fields=LOAN_FIELDS)
+    notify = Subject(membership)
+    notify.events = {'Loans': [], 'Reservations': [], 'NewCards': []}
+    reservations = Reservations(library, membership, notify)
+    reservations.reset()
+    return {'library': library, 'membership': membership, 'loans': loans, 'notify': notify,
+            'reservations': reservations,
+            'loans_interface': LoansInterface(loans, membership, library, reservations, notify),
+            'members_interface': MembersInterface(membership, notify),
+            'reservation_interface': ReservationInterface(reservations, membership, library)}
+
+
+def _timed(func, *args):
+    """:returns float: Seconds taken to run func(*args) with console output suppressed"""
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+
+def scenario_csv_load(system, ops, rng):
+    """ Reloads all three csv files into empty stores """
+    return _timed(build_system, '.'), 1
+
+
+def scenario_json_save(system, ops, rng):
+    """ Saves the books, members and loans stores to JSON """
+    stores = (system['library'], system['membership'], system['loans'])
+    return _timed(lambda: [store.save() for store in stores]), len(stores)
+
+
+def scenario_json_restore(system, ops, rng):
+    """ Restores the books, members and loans stores from JSON """
+    stores = (system['library'], system['membership'], system['loans'])
+    return _timed(lambda: [store.restore() for store in stores]), len(stores)
+
+
+def scenario_checkout(system, ops, rng):
+    """ Checks out one available book to each of ops members """
+    library, membership = system['library'], system['membership']
+    available = [book for book in library.collection.values() if book.is_available()]
+    members = rng.sample(sorted(membership.collection), min(ops, len(membership.collection)))
+    pairs = [(membership.search(uid), book) for uid, book in zip(members, rng.sample(available, len(members)))]
+    checkout = system['loans_interface'].checkout_books
+    return _timed(lambda: [checkout(member, book) for member, book in pairs]), len(pairs)
+
+
+def scenario_return(system, ops, rng):
+    """ Checks out ops books (untimed) then returns them """
+    _timed(scenario_checkout, system, ops, rng)
+    on_loan = [book for book in system['library'].collection.values() if book.is_on_loan()]
+    return_books = system['loans_interface'].return_books
+    return _timed(lambda: [return_books(book) for book in on_loan]), len(on_loan)
+
+
+def scenario_reservation(system, ops, rng):
+    """ Makes ops reservations for random members and books """
+    membership, library = system['membership'], system['library']
+    pairs = [(membership.search(rng.choice(list(membership.collection))), rng.choice(list(library.collection)))
+             for _ in range(ops)]
+    reserve = system['reservation_interface'].make_reservation
+    return _timed(lambda: [reserve(member, book_uid) for member, book_uid in pairs]), len(pairs)
+
+
+def scenario_notification_fanout(system, ops, rng):
+    """ Sends ops single member notifications to an event that every member subscribes to """
+    from Notifications import FineNotification
+
+    notify, membership, library = system['notify'], system['membership'], system['library']
+    notify.events['Loans'] = list(membership.collection)
+    book = next(iter(library.collection.values()))
+    notices = [FineNotification(membership.search(rng.choice(list(membership.collection))), book, 1, 1.0)
+               for _ in range(ops)]
+    return _timed(lambda: [notify.send_email('Loans', notice) for notice in notices]), len(notices)
+
+
+def scenario_notification_digest(system, ops, rng):
+    """ Sends ops notifications, five to each of ops / 5 members, coalesced into one digest per member """
+    from Notifications import FineNotification
+
+    notify, membership, library = system['notify'], system['membership'], system['library']
+    notify.events['Loans'] = list(membership.collection)
+    book = next(iter(library.collection.values()))
+    members = [membership.search(uid) for uid in rng.sample(list(membership.collection), max(1, ops // 5))]
+    notices = [FineNotification(members[index % len(members)], book, 1, 1.0) for index in range(ops)]
+
+    def send():
+        with notify.coalesce():
+            notify.send_emails('Loans', *notices)
+    return _timed(send), len(notices)
+
+
+def scenario_loan_lookup(system, ops, rng):
+    """ Looks up the loan history of ops * 100 random book-member pairs and the current loans of ops members """
+    loans = system['loans']
+    keys = [(loan_items[-1].book_uid, loan_items[-1].member_uid) for loan_items in loans.collection.values()]
+    pairs = [rng.choice(keys) for _ in range(ops * 100)]
+    members = [member_uid for _, member_uid in rng.sample(keys, min(ops, len(keys)))]
+
+    def lookup():
+        for book_uid, member_uid in pairs:
+            loans.search(book_uid, member_uid)
+        for member_uid in members:
+            loans.member_loans(member_uid)
+    return _timed(lookup), len(pairs) + len(members)
+
+
+SCENARIOS = {'csv_load': scenario_csv_load,
+             'json_save': scenario_json_save,
+             'json_restore': scenario_json_restore,
+             'checkout': scenario_checkout,
+             'return': scenario_return,
+             'reservation': scenario_reservation,
+             'notification_fanout': scenario_notification_fanout,
+             'notification_digest': scenario_notification_digest,
+             'loan_lookup': scenario_loan_lookup}
+
+
+def _commit():
+    """:returns str: The current git commit of the repository or None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(books=1000, members=2000, loans=20000, seed=1, ops=20, repeat=3, scenarios=None):
+    """ Generates a data set and times each scenario against it.
+        The best of the repeats is reported for each scenario.
+
+    :param books: int: Number of books to generate
+    :param members: int: Number of members to generate
+    :param loans: int: Number of loans to generate
+    :param seed: int: Seed used for the data and the scenario choices
+    :param ops: int: Number of operations per scenario run where applicable
+    :param repeat: int: Times each scenario is run
+    :param scenarios: List of str: Scenario names to run. Defaults to all
+    :returns dict: JSON compatible results"""
+
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, books, members, loans, seed)
+        os.chdir(directory)
+        try:
+            for name in scenarios or SCENARIOS:
+                timings = []
+                for attempt in range(repeat):
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        system = build_system('.')
+                        for store in ('library', 'membership', 'loans', 'reservations'):
+                            system[store].save()
+                    seconds, count = SCENARIOS[name](system, ops, random.Random(seed + attempt))
+                    timings.append(seconds)
+                best = min(timings)
+                results[name] = {'seconds': best, 'ops': count, 'per_op': best / count if count else None,
+                                 'runs': timings}
+        finally:
+            os.chdir(cwd)
+
+    return {'commit': _commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'params': {'books': books, 'members': members, 'loans': loans, 'seed': seed, 'ops': ops,
+                       'repeat': repeat},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the library benchmark scenarios')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--ops', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run. May be repeated. Defaults to all')
+    parser.add_argument('--output', help='JSON file for the results. Defaults to stdout')
+    args = parser.parse_args()
+
+    results = run(args.books, args.members, args.loans, args.seed, args.ops, args.repeat, args.scenario)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
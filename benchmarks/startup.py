@@ -0,0 +1,103 @@
+"""
+Start up benchmark: import time of the core modules and the latency of the first query after start up.
+
+Each measurement runs in a fresh interpreter. The first query restores the stores from JSON, either eagerly
+(every store restored at start up) or on demand (see _Aggregator.restore_on_demand). With --history the
+results are appended as one JSON line per run so they can be tracked across commits.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.generate import generate
+from benchmarks.run import _commit, build_system
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_QUERY = '''
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+from Library import Library
+from Membership import Membership
+from Loans import Loans
+stores = [Library.get_instance(), Membership.get_instance(), Loans.get_instance()]
+for store in stores:
+    store.restore_on_demand() if {lazy} else store.restore()
+ready = time.perf_counter()
+Library.get_instance().search('1')
+done = time.perf_counter()
+print(ready - start, done - start)
+'''
+
+
+def import_time(module='Interface'):
+    """:returns dict: Cumulative import time in microseconds of module and of each repository module it imports"""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=REPO)
+    local = {name[:-3] for name in os.listdir(REPO) if name.endswith('.py')}
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if match and match.group(3) in local:
+            times[match.group(3)] = int(match.group(1))
+    return times
+
+
+def first_query(directory, lazy):
+    """:returns dict: Seconds until the stores were ready and until the first book search returned"""
+
+    result = subprocess.run([sys.executable, '-c', FIRST_QUERY.format(repo=REPO, lazy=lazy)],
+                            capture_output=True, text=True, cwd=directory, check=True)
+    ready, done = (float(value) for value in result.stdout.split())
+    return {'ready': ready, 'first_query': done}
+
+
+def run(books=1000, members=2000, loans=20000, seed=1):
+    """:returns dict: JSON compatible import and first query timings"""
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, books, members, loans, seed)
+        os.chdir(directory)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                system = build_system('.')
+                for store in ('library', 'membership', 'loans'):
+                    system[store].save()
+        finally:
+            os.chdir(cwd)
+        results = {'import_us': import_time(),
+                   'eager': first_query(directory, False),
+                   'on_demand': first_query(directory, True)}
+
+    return {'commit': _commit(), 'params': {'books': books, 'members': members, 'loans': loans, 'seed': seed},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time and first query latency')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--history', help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    results = run(args.books, args.members, args.loans, args.seed)
+    if args.history:
+        with open(args.history, mode='a', encoding='utf-8') as file:
+            file.write(json.dumps(results) + '\n')
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
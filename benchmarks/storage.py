@@ -0,0 +1,66 @@
+"""
+Side by side comparison of the storage backends.
+Replays the same synthetic stream of operations with each backend and reports throughput, latency and the
+size of the files written.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.generate import generate
+from benchmarks.replay import BACKENDS, replay, synthesize
+from benchmarks.run import _commit, build_system
+
+
+def _size(directory):
+    """:returns int: Total bytes of the files in directory"""
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def run(books=1000, members=2000, loans=20000, ops=1000, seed=1, backends=('json', 'sqlite', 'delta')):
+    """:returns dict: JSON compatible results for each backend"""
+
+    stream = synthesize(books, members, ops, seed)
+    cwd = os.getcwd()
+    results = {}
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as directory:
+            generate(directory, books, members, loans, seed)
+            os.chdir(directory)
+            try:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    system = build_system('.')
+                    for name in ('library', 'membership', 'loans', 'reservations', 'notify'):
+                        system[name].save()
+                    BACKENDS[backend](system)
+                before = _size(directory)
+                report = replay(system, stream)
+                report['bytes_on_disk'] = _size(directory)
+                report['bytes_before'] = before
+                results[backend] = report
+            finally:
+                os.chdir(cwd)
+
+    return {'commit': _commit(), 'params': {'books': books, 'members': members, 'loans': loans, 'ops': ops,
+                                             'seed': seed},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the JSON, SQLite and delta JSON storage backends')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--ops', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    json.dump(run(args.books, args.members, args.loans, args.ops, args.seed), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()